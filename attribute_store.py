@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import numpy as np
+import geopandas as gpd
+'''
+A compact cache of the walls/structures shapefiles, so startup skips parsing them.
+
+readShapefile keeps one uncompressed .npz file per shapefile in the cache directory, holding:
+    meta            json with the signature of the source files, the column names, kinds and order and the crs
+    column<i>       typed array of every attribute column; text columns as fixed width unicode, with
+    null<i>         the mask of their missing values
+    wkb, wkbOffsets the geometries as concatenated well-known binary, and the offset of each one
+    bounds          xmin, ymin, xmax, ymax of every polygon
+The attributes are stored as read, before any clean-up, which depends on the polygons kept and is left to the
+caller; the cache is rebuilt when a source file or the store format changes.
+'''
+# source files of a shapefile that the cached attributes depend on
+SIDECARS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+
+# version of the store format, stored files of another version are rebuilt
+STORE_VERSION = 2
+
+def shapefileSignature(path):
+    base = os.path.splitext(path)[0]
+    files = [(os.path.abspath(base + ext), os.path.getsize(base + ext), os.path.getmtime(base + ext)) for ext in SIDECARS if os.path.exists(base + ext)]
+    return files
+
+def saveAttributeStore(path, signature, shapefile):
+    arrays = dict()
+    columns = []
+    for i, column in enumerate(c for c in shapefile.columns if c != shapefile.geometry.name):
+        values = shapefile[column]
+        if values.dtype.kind in 'biufM':
+            columns.append([column, 'typed'])
+            arrays['column' + str(i)] = values.to_numpy()
+        else:
+            columns.append([column, 'text'])
+            nulls = values.isna().to_numpy()
+            arrays['column' + str(i)] = np.where(nulls, '', values.astype(str)).astype(str)
+            arrays['null' + str(i)] = nulls
+    wkb = [bytes(pg) for pg in shapefile.geometry.to_wkb()]
+    arrays['wkb'] = np.frombuffer(b''.join(wkb), dtype=np.uint8)
+    arrays['wkbOffsets'] = np.concatenate([[0], np.cumsum([len(b) for b in wkb])]).astype(np.int64)
+    arrays['bounds'] = shapefile.geometry.bounds.to_numpy()
+    crs = shapefile.crs.to_wkt() if shapefile.crs is not None else None
+    arrays['meta'] = np.array(json.dumps({'version': STORE_VERSION, 'signature': signature, 'columns': columns, 'order': list(shapefile.columns), 'crs': crs}))
+    with open(path, 'wb') as fp: # an open file, so np.savez does not add its own extension
+        np.savez(fp, **arrays)
+
+# returns the cached shapefile and polygon bounds, or None if the cache is missing or stale
+def loadAttributeStore(path, signature):
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as store:
+        meta = json.loads(str(store['meta']))
+        if meta.get('version') != STORE_VERSION or meta['signature'] != json.loads(json.dumps(signature)):
+            return None
+        columns = dict()
+        for i, (column, kind) in enumerate(meta['columns']):
+            values = store['column' + str(i)]
+            if kind == 'text':
+                values = values.astype(object)
+                values[store['null' + str(i)]] = None
+            columns[column] = values
+        wkb = store['wkb'].tobytes()
+        offsets = store['wkbOffsets']
+        geometry = gpd.GeoSeries.from_wkb([wkb[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)], crs=meta['crs'])
+        bounds = store['bounds']
+    return gpd.GeoDataFrame(columns, geometry=geometry, crs=meta['crs'])[meta['order']], bounds
+
+# returns the shapefile at path and the bounds (xmin, ymin, xmax, ymax) of every polygon; with a cacheDir, read
+# from its attribute store while the source files are unchanged
+def readShapefile(path, cacheDir=None):
+    signature = shapefileSignature(path)
+    if cacheDir:
+        os.makedirs(cacheDir, exist_ok=True)
+        storePath = os.path.join(cacheDir, os.path.splitext(os.path.basename(path))[0] + '_' + hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[0:12] + '.npz')
+        stored = loadAttributeStore(storePath, signature)
+        if stored is not None:
+            return stored
+
+    shapefile = gpd.read_file(path)
+    if cacheDir:
+        saveAttributeStore(storePath, signature, shapefile)
+    return shapefile, shapefile.geometry.bounds.to_numpy()
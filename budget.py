@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import laspy
+from pointcloud import CHUNK_SIZE
+'''
+Helper functions to fit the point cloud in a memory budget, estimated from the LAS headers before any point is read
+'''
+# reductions tried, from all points to every 1000th
+STEPS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+# estimated bytes held per point kept: position (float64), 8 bit RGBA color, height above ground, grid index
+# order and shared cell ids; the actors share the position and color buffers
+BYTES_PER_POINT = 24 + 4 + 8 + 8 + 8
+# per point of each layer covering the whole cloud (height above ground, distance to another epoch): the draw
+# order and ranks of its actor, plus the distances of another epoch
+BYTES_PER_LAYER_POINT = 8 + 8
+BYTES_PER_EPOCH_POINT = 8
+# per point within a polygon: its id and position in the polygon points, the copied position, category and cell
+# ids of the three categorical layers, the values and order of the three numerical layers and its polygon index
+BYTES_PER_POLYGON_POINT = 8 + 24 + 3 * (24 + 8 + 8) + 3 * (8 + 8) + 8
+# per point decoded at once by a reading process: the LAS record, its scaled coordinates and position, and its
+# RGBA color and one float color channel binned into the overview, held for a whole chunk until it is decimated
+BYTES_PER_DECODED_POINT = 34 + 24 + 24 + 4 + 8
+# bytes of a point in a preprocessed points file (float64 positions)
+BYTES_PER_PICKLED_POINT = 24
+# per point kept of another epoch, while the distances to it are found: its positions, and the float64 copy,
+# indices and nodes of the tree over them (its colors, dropped after the read, take less)
+BYTES_PER_OTHER_EPOCH_POINT = 24 + 24 + 8 + 8
+# smallest chunk the reading processes are given, however small the budget
+MIN_CHUNK_SIZE = 250000
+
+# returns the number of points and the xy area covered by the LAS files, from their headers
+def headerStats(paths):
+    nPoints = 0
+    mins = []
+    maxs = []
+    for path in paths:
+        with laspy.open(path) as fp:
+            nPoints += fp.header.point_count
+            mins.append(fp.header.mins[0:2])
+            maxs.append(fp.header.maxs[0:2])
+    extent = np.max(maxs, axis=0) - np.min(mins, axis=0)
+    return nPoints, float(extent[0] * extent[1])
+
+# returns the (workers, chunk size) settings of the reading processes, from the fastest to the one decoding the
+# fewest points at once: fewer workers first, then smaller chunks
+def readerSettings(workers=None, chunkSize=CHUNK_SIZE):
+    workers = workers or os.cpu_count() or 1
+    settings = [(workers, chunkSize)]
+    while workers > 1:
+        workers //= 2
+        settings.append((workers, chunkSize))
+    while chunkSize > MIN_CHUNK_SIZE:
+        chunkSize = max(chunkSize // 2, MIN_CHUNK_SIZE)
+        settings.append((workers, chunkSize))
+    return settings
+
+# returns the estimated bytes and number of points drawn at once (the natural colors and the largest layer);
+# pickleBytes is the total size of the preprocessed points files, read at full density whatever the step, and
+# held twice while their points are gathered. The chunks decoded at once by the workers are added on top, and
+# with a second whole cloud layer, the other epoch of otherPoints points read with the same step
+def estimateFootprint(nPoints, step, insideFraction, insideStep=None, pointLayers=1, pickleBytes=0, workers=None,
+                      chunkSize=CHUNK_SIZE, otherPoints=0):
+    inside = nPoints * insideFraction / (insideStep or step)
+    kept = nPoints / step + (inside if insideStep else 0)
+    pickled = pickleBytes / BYTES_PER_PICKLED_POINT
+    decoding = (workers or os.cpu_count() or 1) * min(chunkSize, nPoints) * BYTES_PER_DECODED_POINT
+    other = (pointLayers > 1) * otherPoints / step * BYTES_PER_OTHER_EPOCH_POINT
+    nBytes = (kept * (BYTES_PER_POINT + pointLayers * BYTES_PER_LAYER_POINT + (pointLayers > 1) * BYTES_PER_EPOCH_POINT)
+              + (inside + pickled) * BYTES_PER_POLYGON_POINT + pickleBytes + decoding + other)
+    gpuPoints = kept + max(kept if pointLayers else 0, inside + pickled)
+    return nBytes, gpuPoints
+
+# returns the smallest reduction, the layer strategy and the reader settings that fit maxBytes and maxGpuPoints
+# (either may be None), as (step, whether the layers covering the whole cloud are built, (workers, chunk size),
+# estimated bytes, estimated points drawn, whether it fits); the strongest reduction without those layers and
+# with the smallest reader settings if nothing fits. The readers are slowed down before the layers are dropped,
+# and both before the points are reduced. The points within the polygons are assumed to be spread like the rest,
+# in proportion to the area of the polygons classified while reading; the points of polygons read from the
+# preprocessed points files at pickles are counted from the size of those files. otherPaths are the LAS files
+# of another epoch, read with the same step for the second whole cloud layer
+def chooseReduction(paths, polygonArea, maxBytes=None, maxGpuPoints=None, insideStep=None, pointLayers=1, pickles=(), otherPaths=()):
+    nPoints, area = headerStats(paths)
+    otherPoints = headerStats(otherPaths)[0] if otherPaths else 0
+    insideFraction = min(polygonArea / max(area, 1e-9), 1)
+    pickleBytes = sum(os.path.getsize(path) for path in pickles)
+    for step in STEPS:
+        for layers in sorted({pointLayers, 0}, reverse=True): # whole cloud layers are dropped before points are
+            for workers, chunkSize in readerSettings():
+                nBytes, gpuPoints = estimateFootprint(nPoints, step, insideFraction, insideStep, layers, pickleBytes, workers, chunkSize, otherPoints)
+                if (maxBytes is None or nBytes <= maxBytes) and (maxGpuPoints is None or gpuPoints <= maxGpuPoints):
+                    return step, layers > 0, (workers, chunkSize), nBytes, gpuPoints, True
+    return step, False, (workers, chunkSize), nBytes, gpuPoints, False
@@ -0,0 +1,34 @@
+import os
+import numpy as np
+import concurrent.futures
+from scipy.spatial import cKDTree
+'''
+Helper functions to compare the point cloud with another survey epoch of the site
+'''
+# number of points queried by one process at a time
+CHUNK_SIZE = 1000000
+
+# tree over the other epoch and points to query, shared by the worker processes
+_tree = None
+_points = None
+
+def _initWorker(tree, points):
+    global _tree, _points
+    _tree = tree
+    _points = points
+
+# returns the distance from each point of one chunk to the nearest point of the other epoch
+def queryChunk(chunk):
+    start, stop = chunk
+    return _tree.query(_points[start:stop], k=1)[0]
+
+# returns the distance from every point to its nearest neighbour in reference; the tree over reference is built
+# once, and the points are queried in chunks by a process pool
+def nearestDistances(points, reference, chunkSize=CHUNK_SIZE, workers=None):
+    tree = cKDTree(reference)
+    chunks = [(start, min(start + chunkSize, len(points))) for start in range(0, len(points), chunkSize)]
+    distances = np.empty(len(points), dtype=np.float64)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_initWorker, initargs=(tree, points)) as executor:
+        for (start, stop), chunkDistances in zip(chunks, executor.map(queryChunk, chunks)):
+            distances[start:stop] = chunkDistances
+    return distances
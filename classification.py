@@ -0,0 +1,241 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import concurrent.futures
+from functools import partial
+from spatial_index import Grid
+'''
+Helper functions to find the points of the point cloud within each wall/structure polygon
+'''
+# number of (point, edge) pairs tested at once by containsPoints
+BATCH_PAIRS = 2**20
+
+# returns every ring (exterior and interiors) of every part of a Polygon or MultiPolygon as an array of coordinates
+def polygonRings(pg):
+    parts = pg.geoms if pg.geom_type == 'MultiPolygon' else [pg]
+    rings = []
+    for poly in parts:
+        rings.append(np.asarray(poly.exterior.coords)[:,0:2])
+        rings.extend(np.asarray(ring.coords)[:,0:2] for ring in poly.interiors)
+    return rings
+
+# returns the edges of all rings of pg as an (n, 4) array of x0, y0, x1, y1
+def polygonEdges(pg):
+    edges = [np.hstack([ring, np.roll(ring, -1, axis=0)]) for ring in polygonRings(pg)]
+    return np.concatenate(edges) if edges else np.empty((0, 4))
+
+# returns a mask of the points of xy inside pg, using the even-odd rule over all rings, so holes and
+# multiple parts are handled; only the points in the polygon's bounding box are tested, in batches
+def containsPoints(pg, xy):
+    b = pg.bounds
+    mask = np.zeros(len(xy), dtype=bool)
+    if len(b) == 0:
+        return mask
+    candidates = np.flatnonzero((xy[:,0]>=b[0]) * (xy[:,0]<=b[2]) * (xy[:,1]>=b[1]) * (xy[:,1]<=b[3]))
+
+    x0, y0, x1, y1 = polygonEdges(pg).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (x1 - x0) / (y1 - y0) # horizontal edges never cross the ray, so their slope is unused
+
+    batch = max(BATCH_PAIRS // max(len(x0), 1), 1)
+    for start in range(0, len(candidates), batch):
+        ids = candidates[start:start+batch]
+        x = xy[ids,0][:,None]
+        y = xy[ids,1][:,None]
+        # count the edges crossed by a ray going from each point towards +x
+        crosses = (y0 > y) != (y1 > y)
+        with np.errstate(invalid='ignore'):
+            crosses &= x < x0 + (y - y0) * slope
+        mask[ids] = np.count_nonzero(crosses, axis=1) % 2 == 1
+    return mask
+
+# used by realBoundary function to find points within actual polygons in parallel
+def parallelFunction(args):
+    pg, pc_array = args
+    mask = containsPoints(pg, pc_array[:,0:2])
+    x = pc_array[mask]
+    return x
+
+# finds the points within each polygon, runs in parallel
+def realBoundary(shapefile, pc_array):
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        pts = [i for i in executor.map(parallelFunction, [[pg, pc_array] for pg in shapefile['geometry']])]
+    return pts
+
+# finds the points within the bounding box of each polygon; faster than realBoundary, but not as accurate
+def boundingBox(shapefile, pc_array):
+    pts = []
+    for pg in shapefile['geometry'].apply(lambda x: x.bounds[:]):
+        mask = (pc_array[:,0]>pg[0]) * (pc_array[:,0]<pg[2]) * (pc_array[:,1]>pg[1]) * (pc_array[:,1]<pg[3])
+        pts.append(pc_array[mask])
+    return pts
+
+# returns the ids of the points within the bounding box of each polygon, or within the polygon itself if boundaries is set
+# runs serially; used on one chunk of the point cloud at a time, polygons that miss the chunk are skipped.
+# With a GridIndex over the points, only the points in the cells under each polygon are looked at
+def boundaryIndices(geometries, boundaries, pc_array, grid=None):
+    empty = np.empty(0, dtype=np.int64)
+    if len(pc_array) == 0:
+        return [empty for pg in geometries]
+    mins = pc_array[:,0:2].min(axis=0)
+    maxs = pc_array[:,0:2].max(axis=0)
+
+    ids = []
+    for pg in geometries:
+        b = pg.bounds
+        if b[2] < mins[0] or b[0] > maxs[0] or b[3] < mins[1] or b[1] > maxs[1]:
+            ids.append(empty)
+            continue
+        if grid is not None:
+            candidates = np.sort(grid.query((b[0], b[2], b[1], b[3])))
+            xy = pc_array[candidates,0:2]
+        else:
+            xy = pc_array[:,0:2]
+        if boundaries:
+            mask = containsPoints(pg, xy)
+        else:
+            mask = (xy[:,0]>b[0]) * (xy[:,0]<b[2]) * (xy[:,1]>b[1]) * (xy[:,1]<b[3])
+        ids.append(candidates[mask] if grid is not None else np.flatnonzero(mask))
+    return ids
+
+# describes how points are classified, so cached memberships are only reused with the same settings
+def classificationEngine(boundaries, raster=None, refine=False):
+    if raster:
+        return ('raster', raster, refine)
+    return 'boundaries' if boundaries else 'bbox'
+
+# returns the function finding the ids of the points within each of geometries, based on either
+# a label raster, polygons or bounding boxes
+def pointClassifier(geometries, boundaries, raster=None, refine=False, grid=None):
+    if raster:
+        return partial(LabelRaster(geometries, raster).indices, refine=refine)
+    return partial(boundaryIndices, list(geometries), boundaries, grid=grid)
+
+# returns the concatenation of the ranges [lo[i], hi[i]) without a python loop
+def _ranges(lo, hi):
+    lengths = hi - lo
+    starts = np.repeat(lo - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return starts + np.arange(lengths.sum())
+
+class LabelRaster(Grid):
+    # rasterizes all polygons once into an integer label image with cells of resolution x resolution meters;
+    # a cell holds the id of the polygon covering its center, or -1. Cells crossed by a polygon edge, or covered
+    # by more than one polygon, are flagged as boundary cells and remember their candidate polygons
+    def __init__(self, geometries, resolution):
+        self.geometries = list(geometries)
+        self.resolution = resolution
+
+        # the origin is snapped to the resolution, so a polygon is rasterized the same way whatever the other polygons are
+        bounds = np.array([pg.bounds for pg in self.geometries]).reshape(-1, 4)
+        origin = (np.floor(bounds[:,0:2].min(axis=0) / resolution) - 1) * resolution if len(bounds) else np.zeros(2)
+        maxs = bounds[:,2:4].max(axis=0) + resolution if len(bounds) else np.ones(2)
+        super(LabelRaster, self).__init__(origin, resolution, maxs=maxs)
+
+        self.labels = np.full(self.shape, -1, dtype=np.int32)
+        self.boundary = np.zeros(self.shape, dtype=bool)
+        pairCells = [] # (cell, polygon) candidates for the boundary cells
+        pairPolygons = []
+
+        for k, pg in enumerate(self.geometries):
+            # label the cells whose center falls inside the polygon, within the polygon's bounding box
+            (ix0, ix1), (iy0, iy1) = self.cellCoords(np.array([bounds[k,0:2], bounds[k,2:4]]), clamp=False)
+            cx = self.origin[0] + (np.arange(ix0, ix1 + 1) + 0.5) * resolution
+            cy = self.origin[1] + (np.arange(iy0, iy1 + 1) + 0.5) * resolution
+            centers = np.stack(np.meshgrid(cx, cy), axis=-1).reshape(-1, 2)
+            inside = containsPoints(pg, centers).reshape(len(cy), len(cx))
+            window = self.labels[iy0:iy1+1, ix0:ix1+1]
+
+            # cells already labeled by another polygon become boundary cells of both
+            overlap = inside & (window >= 0)
+            if overlap.any():
+                oy, ox = np.nonzero(overlap)
+                cells = (oy + iy0) * self.shape[1] + (ox + ix0)
+                pairCells.extend([cells, cells])
+                pairPolygons.extend([window[overlap].astype(np.int64), np.full(len(cells), k, dtype=np.int64)])
+            window[inside] = k
+
+            # flag the cells crossed by the polygon's edges, sampled at half a cell, plus their neighbours
+            # so that edges clipping the corner of a cell between two samples are not missed
+            cells = np.unique(self.cellOf(self.sampleRings(pg)))
+            ix, iy = cells % self.shape[1], cells // self.shape[1]
+            ix = np.clip((ix[:,None] + [-1, 0, 1, -1, 0, 1, -1, 0, 1]).ravel(), 0, self.shape[1] - 1)
+            iy = np.clip((iy[:,None] + [-1, -1, -1, 0, 0, 0, 1, 1, 1]).ravel(), 0, self.shape[0] - 1)
+            cells = np.unique(iy * self.shape[1] + ix)
+            pairCells.append(cells)
+            pairPolygons.append(np.full(len(cells), k, dtype=np.int64))
+
+        pairCells = np.concatenate(pairCells) if pairCells else np.empty(0, dtype=np.int64)
+        pairPolygons = np.concatenate(pairPolygons) if pairPolygons else np.empty(0, dtype=np.int64)
+        self.boundary.ravel()[pairCells] = True
+
+        # a boundary cell may lie inside the polygon that labels it, which is then a candidate too
+        labels = self.labels.ravel()[pairCells]
+        pairCells = np.concatenate([pairCells, pairCells[labels >= 0]])
+        pairPolygons = np.concatenate([pairPolygons, labels[labels >= 0].astype(np.int64)])
+
+        # candidate cells of each polygon, stored sorted by polygon
+        pairs = np.unique(np.stack([pairPolygons, pairCells], axis=1), axis=0)
+        self.candidateCells = pairs[:,1]
+        self.candidateOffsets = np.searchsorted(pairs[:,0], np.arange(len(self.geometries) + 1))
+
+    # points along every ring of pg, at most half a cell apart
+    def sampleRings(self, pg):
+        p0, p1 = np.hsplit(polygonEdges(pg), 2)
+        n = np.ceil(np.hypot(*(p1 - p0).T) / (self.resolution / 2)).astype(np.int64) + 1
+        t = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+        t = t / np.repeat(np.maximum(n - 1, 1), n)
+        return np.repeat(p0, n, axis=0) + t[:,None] * np.repeat(p1 - p0, n, axis=0)
+
+    # returns the ids of the points within each polygon with one lookup per point; with refine, the points in
+    # boundary cells are tested against the exact candidate polygons of their cell, matching realBoundary
+    def indices(self, pc_array, refine=False):
+        ix, iy = self.cellCoords(pc_array[:,0:2], clamp=False)
+        onRaster = np.flatnonzero((ix >= 0) & (ix < self.shape[1]) & (iy >= 0) & (iy < self.shape[0]))
+        cells = iy[onRaster] * self.shape[1] + ix[onRaster]
+        labels = self.labels.ravel()[cells]
+
+        if refine:
+            isBoundary = self.boundary.ravel()[cells]
+            labels[isBoundary] = -1
+            boundaryIds = onRaster[isBoundary]
+            boundaryCells = cells[isBoundary]
+            order = np.argsort(boundaryCells, kind='stable')
+            boundaryIds, boundaryCells = boundaryIds[order], boundaryCells[order]
+
+        # group the labeled points by polygon
+        labeled = labels >= 0
+        order = np.argsort(labels[labeled], kind='stable')
+        counts = np.bincount(labels[labeled], minlength=len(self.geometries))
+        ids = np.split(onRaster[labeled][order], np.cumsum(counts)[:-1])
+
+        if refine:
+            for k, pg in enumerate(self.geometries):
+                candidates = self.candidateCells[self.candidateOffsets[k]:self.candidateOffsets[k+1]]
+                lo = np.searchsorted(boundaryCells, candidates, 'left')
+                hi = np.searchsorted(boundaryCells, candidates, 'right')
+                idx = boundaryIds[_ranges(lo, hi)]
+                if len(idx):
+                    idx = idx[containsPoints(pg, pc_array[idx,0:2])]
+                    ids[k] = np.sort(np.concatenate([ids[k], idx]))
+        return ids
+
+# returns a hash of every geometry and of the engine settings used to classify it, so a re-issued shapefile
+# can be diffed against the memberships of a previous run
+def geometryHashes(geometries, engine):
+    return [hashlib.sha1(pg.wkb + repr(engine).encode()).hexdigest() for pg in geometries]
+
+# returns the cached (geometry hash: point ids) memberships, or an empty dict if the cache is missing or was
+# built from another point cloud
+def loadMembershipCache(path, signature):
+    if not os.path.exists(path):
+        return dict()
+    with open(path, 'rb') as fp:
+        cache = pickle.load(fp)
+    if cache['signature'] != signature:
+        return dict()
+    return cache['memberships']
+
+def saveMembershipCache(path, signature, memberships):
+    with open(path, 'wb') as fp:
+        pickle.dump({'signature': signature, 'memberships': memberships}, fp, protocol=pickle.HIGHEST_PROTOCOL)
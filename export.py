@@ -0,0 +1,187 @@
+import os
+import json
+import collections
+import numpy as np
+import laspy
+import concurrent.futures
+from spatial_index import tileGroups
+'''
+Helper functions to export the point cloud and its attribute layers for sharing without the Python stack.
+
+exportTiles writes a static directory that a lightweight viewer can load lazily or a static file server can
+serve. index.json describes every layer; each layer is cut into square tiles on the xy plane, and the points
+of each tile are shuffled and split into levels of growing density, one little-endian binary file per level:
+    positions   float32 x, y, z per point, relative to the offset in index.json
+    colors      uint8 r, g, b per point, for the 'rgb' layer
+    values      float32 per point, for 'scalar' layers, or the category index for 'category' layers
+Loading the levels of a tile in order refines it progressively. Tile bounds in index.json are relative to the offset too.
+
+exportSelection writes the points of a selection of walls/structures to one LAS or binary PLY file, with their
+colors and the values of the numerical attributes, streamed in chunks so memory stays bounded by a chunk.
+'''
+# number of points written at a time by exportSelection
+WRITE_CHUNK = 1000000
+# writes the levels of one tile and returns its entry in index.json
+def writeTile(task):
+    outdir, layerDir, key, positions, colors, values, basePoints = task
+    tx, ty = key
+
+    # deterministic shuffle, so every level is a uniform sample of the tile
+    order = np.random.default_rng(tx * 1000003 + ty).permutation(len(positions))
+    levels = []
+    start = 0
+    size = basePoints
+    while start < len(order):
+        ids = order[start:start+size]
+        fileName = layerDir + '/' + str(tx) + '_' + str(ty) + '_' + str(len(levels)) + '.bin'
+        with open(os.path.join(outdir, fileName), 'wb') as fp:
+            fp.write(np.ascontiguousarray(positions[ids], dtype='<f4').tobytes())
+            if colors is not None:
+                fp.write(np.ascontiguousarray(colors[ids], dtype=np.uint8).tobytes())
+            if values is not None:
+                fp.write(np.ascontiguousarray(values[ids], dtype='<f4').tobytes())
+        levels.append({'file': fileName, 'points': int(len(ids))})
+        start += size
+        size *= 4 # each level doubles the linear density
+    mins = positions.min(axis=0)
+    maxs = positions.max(axis=0)
+    return {'x': int(tx), 'y': int(ty), 'bounds': [float(v) for v in np.concatenate([mins, maxs])], 'levels': levels}
+
+# yields one task per tile of a layer, gathering only that tile's points
+def tileTasks(outdir, layerDir, layer, offset, tileSize, basePoints):
+    points = layer['points']
+    for tx, ty, ids in tileGroups(points, tileSize, offset):
+        positions = points[ids] - offset
+        colors = layer['colors'][ids,0:3] if layer.get('colors') is not None else None
+        values = layer['values'][ids] if layer.get('values') is not None else None
+        yield (outdir, layerDir, (tx, ty), positions, colors, values, basePoints)
+
+# exports layers, a dict of (layer name: dict with 'points' and either 'colors' or 'values', plus 'categories'
+# for categorical values) into outdir; tiles are written by a process pool with a bounded number of tiles in
+# flight, so memory stays bounded by a few tiles on top of the layers themselves
+def exportTiles(outdir, layers, tileSize=50.0, basePoints=4096, workers=None):
+    os.makedirs(outdir, exist_ok=True)
+    offset = np.min([layer['points'].min(axis=0) for layer in layers.values() if len(layer['points'])], axis=0)
+    index = {'version': 1, 'offset': [float(v) for v in offset], 'tileSize': tileSize, 'layers': []}
+
+    workers = workers or os.cpu_count()
+    maxInFlight = 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, (name, layer) in enumerate(layers.items()):
+            layerDir = 'layer' + str(i).zfill(2)
+            os.makedirs(os.path.join(outdir, layerDir), exist_ok=True)
+            entry = {'name': name, 'directory': layerDir, 'points': int(len(layer['points']))}
+            if layer.get('colors') is not None:
+                entry['type'] = 'rgb'
+            elif layer.get('categories') is not None:
+                entry['type'] = 'category'
+                entry['categories'] = [str(c) for c in layer['categories']]
+            else:
+                entry['type'] = 'scalar'
+                entry['range'] = [float(np.nanmin(layer['values'])), float(np.nanmax(layer['values']))] if len(layer['values']) else [0, 0]
+
+            entry['tiles'] = []
+            if len(layer['points']):
+                inFlight = collections.deque()
+                for task in tileTasks(outdir, layerDir, layer, offset, tileSize, basePoints):
+                    inFlight.append(executor.submit(writeTile, task))
+                    if len(inFlight) >= maxInFlight:
+                        entry['tiles'].append(inFlight.popleft().result())
+                entry['tiles'].extend(future.result() for future in inFlight)
+            index['layers'].append(entry)
+            print(name + ': ' + str(len(entry['tiles'])) + ' tiles exported')
+
+    with open(os.path.join(outdir, 'index.json'), 'w') as fp:
+        json.dump(index, fp)
+
+# returns the positions of the polygons of every shapefile of the model matching any of the selections, a list
+# of (shapefile name, column, value); all polygons if selections is None
+def selectedPolygons(model, selections):
+    polygons = dict()
+    for name, shapefile in model.shapefiles.items():
+        if selections is None:
+            polygons[name] = np.arange(len(shapefile))
+        else:
+            matches = [model.polygonsWhere(name, column, value) for selName, column, value in selections if selName == name]
+            polygons[name] = np.unique(np.concatenate(matches + [np.empty(0, dtype=np.int64)]))
+    return polygons
+
+# yields the points of the selected polygons in chunks of about chunkSize points, as (points, colors, fields);
+# the points are read from the polygon memberships found when the model was built
+def selectionChunks(model, polygons, fields, chunkSize=WRITE_CHUNK):
+    buffers = []
+    nBuffered = 0
+    for k, name in enumerate(model.shapefiles):
+        shapefile = model.shapefiles[name]
+        for i in polygons[name]:
+            points = model.pointsOfPolygons(name, [i])[0]
+            if model.polygonIds[name] is not None:
+                colors = model.colors[model.polygonIds[name][i]]
+            else: # points read from a preprocessed points file have no colors
+                colors = np.zeros((len(points), 4), dtype=np.uint8)
+            values = dict()
+            for field, attribute in fields.items():
+                if attribute == 'Height Above Ground':
+                    values[field] = model.groundModel.heightAboveGround(points)
+                else:
+                    column = model.numericalDict[attribute][k]
+                    values[field] = np.full(len(points), shapefile[column].values[i] if column is not None else np.nan)
+            buffers.append((points, colors, values))
+            nBuffered += len(points)
+            if nBuffered >= chunkSize:
+                yield joinChunks(buffers, fields)
+                buffers = []
+                nBuffered = 0
+    if buffers:
+        yield joinChunks(buffers, fields)
+
+def joinChunks(buffers, fields):
+    points = np.concatenate([b[0] for b in buffers], axis=0)
+    colors = np.concatenate([b[1] for b in buffers], axis=0)
+    return points, colors, {field: np.concatenate([b[2][field] for b in buffers]) for field in fields}
+
+def writeLAS(path, count, mins, chunks, fields):
+    header = laspy.LasHeader(point_format=3, version='1.2')
+    header.offsets = mins
+    header.scales = [0.001, 0.001, 0.001]
+    header.add_extra_dims([laspy.ExtraBytesParams(name=field, type=np.float32) for field in fields])
+    with laspy.open(path, mode='w', header=header) as writer:
+        for points, colors, values in chunks:
+            record = laspy.ScaleAwarePointRecord.zeros(len(points), header=header)
+            record.x = points[:,0]
+            record.y = points[:,1]
+            record.z = points[:,2]
+            record.red, record.green, record.blue = (colors[:,0:3].astype(np.uint16) * 257).T # 8 to 16 bits
+            for field in fields:
+                record[field] = values[field]
+            writer.write_points(record)
+
+def writePLY(path, count, mins, chunks, fields):
+    dtype = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('red', 'u1'), ('green', 'u1'), ('blue', 'u1')] + [(field, '<f4') for field in fields])
+    with open(path, 'wb') as fp:
+        header = ['ply', 'format binary_little_endian 1.0', 'element vertex ' + str(count),
+                  'property double x', 'property double y', 'property double z',
+                  'property uchar red', 'property uchar green', 'property uchar blue']
+        header += ['property float ' + field for field in fields]
+        fp.write(('\n'.join(header + ['end_header']) + '\n').encode('ascii'))
+        for points, colors, values in chunks:
+            record = np.empty(len(points), dtype=dtype)
+            record['x'], record['y'], record['z'] = points.T
+            record['red'], record['green'], record['blue'] = colors[:,0:3].T
+            for field in fields:
+                record[field] = values[field]
+            fp.write(record.tobytes())
+
+# writes the points of the walls/structures matching any of the selections, a list of (shapefile name, column,
+# value), or of all walls/structures if selections is None, to path; a LAS file if path ends with .las, a binary
+# PLY file otherwise. Every numerical attribute is written as an extra field with the value of the polygon of each point
+def exportSelection(path, model, selections=None):
+    polygons = selectedPolygons(model, selections)
+    fields = {attribute.lower().replace(' ', '_'): attribute for attribute in model.numericalDict}
+    count = sum(int(np.sum(np.diff(model.polygonOffsets[name])[polygons[name]])) for name in polygons)
+    views = [points for name in polygons for points in model.pointsOfPolygons(name, polygons[name])]
+    mins = np.min([points.min(axis=0) for points in views], axis=0) if views else np.zeros(3)
+
+    write = writeLAS if path.lower().endswith('.las') else writePLY
+    write(path, count, mins, selectionChunks(model, polygons, fields), fields)
+    print(path + ': ' + str(count) + ' points exported')
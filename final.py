@@ -1,45 +1,50 @@
 import vtk
 import numpy as np
-import laspy
-import vtk.util.numpy_support as vtk_np
 import argparse
 import sys
 from math import floor
-import geopandas as gpd
-import concurrent.futures
-import matplotlib.path as mpltPath
+from functools import partial
 from vtk_colorbar import colorbar, colorbar_param
-import pickle
-import pandas as pd
-
-
-from PyQt6.QtWidgets import QApplication, QWidget, QMainWindow, QComboBox, QGridLayout, QLabel, QPushButton
-from PyQt6.QtCore import Qt
+from site_model import SiteModel
+from export import exportTiles, exportSelection
+from paging import buildTileStore, TilePager
+from classification import polygonRings
+from vtk_buffers import BufferManager
+from poster import renderPoster
+
+
+from PyQt6.QtWidgets import QApplication, QWidget, QMainWindow, QComboBox, QGridLayout, QLabel, QPushButton, QFileDialog, QSlider
+from PyQt6.QtCore import Qt, QPointF
+from PyQt6.QtGui import QImage, QPixmap, QPainter, QPen, QColor, QPolygonF
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_qtagg import FigureCanvasQTAgg
 from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 
-# wrapper class for pointcloud actor
+# wrapper class for pointcloud actor; the points, colors, values and cells are handed to VTK by the buffer manager
+# without copying them. With an order, the points are drawn in that order, and ids used by the wrapper (clip,
+# id range, level of detail) are positions in it, e.g. to share the points of the whole cloud with a layer
+# sorted by value
 class VTKActorWrapper(object):
-    def __init__(self, nparray, colors=None, values=None):
+    def __init__(self, buffers, layer, nparray, colors=None, values=None, order=None):
         super(VTKActorWrapper, self).__init__()
 
+        self.buffers = buffers
+        self.layer = layer
         self.nparray = nparray
+        self.order = order
+        self.ranks = None # position in the order of every point, computed on first use
 
-        nCoords = nparray.shape[0]
-
-        self.verts = vtk.vtkPoints()
-        self.cells = vtk.vtkCellArray()
+        self.nCoords = nparray.shape[0] if order is None else len(order)
 
         self.pd = vtk.vtkPolyData()
-        self.verts.SetData(vtk_np.numpy_to_vtk(nparray))
-        self.cells_npy = np.vstack([np.ones(nCoords,dtype=np.int64),
-                               np.arange(nCoords,dtype=np.int64)]).T.flatten()
-        self.cells.SetCells(nCoords,vtk_np.numpy_to_vtkIdTypeArray(self.cells_npy))
+        self.verts = buffers.points(layer, nparray)
+        self.cells = buffers.cells(layer, self.nCoords, order)
         self.pd.SetPoints(self.verts)
         self.pd.SetVerts(self.cells)
         if colors is not None: # sets specific colors to points if passed in
-            self.pd.GetPointData().SetScalars(vtk_np.numpy_to_vtk(colors))
+            self.pd.GetPointData().SetScalars(buffers.wrap(layer, colors))
         elif values is not None: # sets sepcific values to points if passed in
-            self.pd.GetPointData().SetScalars(vtk_np.numpy_to_vtk(values))
+            self.pd.GetPointData().SetScalars(buffers.wrap(layer, values))
 
         self.mapper = vtk.vtkPolyDataMapper()
         self.mapper.SetInputDataObject(self.pd)
@@ -50,6 +55,90 @@ class VTKActorWrapper(object):
         self.actor.SetMapper(self.mapper)
         self.actor.GetProperty().SetRepresentationToPoints()
 
+        self.index = None # GridIndex over the points, set when the actor can be clipped
+        self.clipIds = None # ids of the points inside the clip region, None when not clipped
+        self.idRange = None # (first, last + 1) ids of the points drawn, None when not filtered
+        self.lodOrder = None # random order of the points as cell ids, set when the actor has an interactive level of detail
+        self.lodRanks = None # rank in the random order of the point at each id
+        self.mirrors = [] # actors drawing this actor's polydata in other views
+
+    # only draw the points with the given ids, or all points if ids is None; the points themselves are left untouched
+    def setVisibleIds(self, ids):
+        if ids is None: # the cells of all points are kept around, so going back to them is free
+            self.pd.SetVerts(self.cells)
+        else:
+            self.setVisibleCells(np.asarray(ids, dtype=np.int64) if self.order is None else self.order[ids])
+
+    # only draw the points with ids from first to last - 1; the cells are views into the shared ids or the
+    # order, so nothing is allocated
+    def setVisibleRange(self, first, last):
+        self.setVisibleCells(self.buffers.ids[first:last] if self.order is None else self.order[first:last])
+
+    # draws the given cell ids, points of nparray rather than positions in the order; a contiguous int64 array
+    # is handed to VTK as it is
+    def setVisibleCells(self, cells):
+        self.pd.SetVerts(self.buffers.cells(self.layer, len(cells), cells))
+        self.pd.Modified()
+
+    # draws the points inside both the clip region and the id range; with a fraction below 1, only a random
+    # subset of them, taken from the level of detail order
+    def updateVisible(self, fraction=1):
+        ids = self.clipIds
+        if self.idRange is not None:
+            first, last = self.idRange
+            if ids is None and fraction >= 1:
+                self.setVisibleRange(first, last)
+                return
+            ids = np.arange(first, last) if ids is None else ids[(ids >= first) & (ids < last)]
+        if fraction < 1:
+            nCoords = len(self.lodOrder)
+            if ids is None: # a prefix of the random order, already as cell ids, so nothing is allocated
+                self.setVisibleCells(self.lodOrder[:int(fraction * nCoords)])
+                return
+            ids = ids[self.lodRanks[ids] < fraction * nCoords]
+        self.setVisibleIds(ids)
+
+    # restricts the drawn points to bounds (xmin, xmax, ymin, ymax), or draws all points if bounds is None
+    def clip(self, bounds):
+        self.clipIds = None if bounds is None else self.index.query(bounds)
+        if self.clipIds is not None and self.order is not None: # the index is over the points, not their order
+            if self.ranks is None:
+                self.ranks = np.empty_like(self.order)
+                self.ranks[self.order] = np.arange(len(self.order))
+            self.clipIds = self.ranks[self.clipIds]
+        self.updateVisible()
+
+    # restricts the drawn points to the ids from first to last - 1, or draws all points if first is None
+    def setIdRange(self, first, last=None):
+        self.idRange = None if first is None else (first, last)
+        self.updateVisible()
+
+    # draws the points in a random order computed once, so any fraction of them can be picked instantly; the
+    # order is kept as int64 cell ids, mapped through the draw order, so its prefixes go to VTK as they are
+    def enableLOD(self, rng):
+        nCoords = self.nCoords
+        dtype = np.int32 if nCoords < 2**31 else np.int64
+        lodOrder = rng.permutation(nCoords).astype(np.int64)
+        self.lodRanks = np.empty(nCoords, dtype=dtype)
+        self.lodRanks[lodOrder] = np.arange(nCoords, dtype=dtype)
+        self.lodOrder = lodOrder if self.order is None else self.order[lodOrder]
+
+    # draws a random fraction of the visible points, or all of them if fraction is 1
+    def setDetail(self, fraction):
+        self.updateVisible(fraction)
+
+    # returns a new actor sharing the mapper and property of this one, to draw the same points in another view;
+    # the points, colors and cells are not copied, and clipping or filtering this wrapper applies to every mirror
+    def mirror(self):
+        actor = vtk.vtkActor()
+        actor.ShallowCopy(self.actor)
+        self.mirrors.append(actor)
+        return actor
+
+    # whether the points are drawn in any view
+    def isVisible(self):
+        return self.actor.GetVisibility() or any(actor.GetVisibility() for actor in self.mirrors)
+
 frame_counter = 0
 
 # screenshot function
@@ -69,40 +158,134 @@ def save_frame(window):
     frame_counter += 1
     print(file_name + " has been successfully exported")
 
-# returns dictionary of (category string: list of points) key-value pairs, creating a apir for each category in shapefile['header']
-def categorical_arrays(shapefile, header):
-    return shapefile.groupby(header)['pts'].agg(lambda x: np.concatenate(x.values, axis=0)).to_dict()
-
-# used by realBoundary function to find points within actual polygons in parallel
-def parallelFunction(args):
-    pg, pc_array = args
-    if pg.geom_type == 'Polygon':
-        coords = pg.exterior.coords
-        # print(coords)
-    elif pg.geom_type == 'MultiPolygon':
-        coords = np.concatenate([poly.exterior.coords for poly in pg.geoms])
-
-    path = mpltPath.Path(coords)
-    mask = path.contains_points(pc_array[:,0:2])
-    x = pc_array[mask]
-    return x
-
-# finds the points within each polygon, runs in parallel
-def realBoundary(shapefile, pc_array):
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        pts = [i for i in executor.map(parallelFunction, [[pg, pc_array] for pg in shapefile['geometry']])]
-    return pts
-
-# finds the points within the bounding box of each polygon; faster than realBoundary, but not as accurate
-def boundingBox(shapefile, pc_array):
-    pts = []
-    for pg in shapefile['geometry'].apply(lambda x: x.bounds[:]):
-        mask = (pc_array[:,0]>pg[0]) * (pc_array[:,0]<pg[2]) * (pc_array[:,1]>pg[1]) * (pc_array[:,1]<pg[3])
-        pts.append(pc_array[mask])
-    return pts
+# top-down overview map of the point cloud with the wall and structure outlines; clicking it calls callback
+# with the x, y coordinates of the clicked point
+class OverviewWidget(QLabel):
+    def __init__(self, width=300):
+        super(OverviewWidget, self).__init__()
+        self.mapWidth = width
+        self.raster = None
+        self.callback = None
+        # the map is drawn from the top left corner of the label, so clicks map back from there
+        self.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
+
+    # draws the raster, as mean colors or as point density, and the outlines, a list of lists of rings per color
+    def setRaster(self, raster, outlines, density=False):
+        self.raster = raster
+        self.outlines = outlines
+        self.image = raster.image(density) # QImage does not copy the pixels, so they are kept here
+        height, width = self.image.shape[0:2]
+        pixmap = QPixmap.fromImage(QImage(self.image.data, width, height, 3 * width, QImage.Format.Format_RGB888))
+        self.scale = self.mapWidth / width
+        pixmap = pixmap.scaledToWidth(self.mapWidth)
+
+        painter = QPainter(pixmap)
+        for color, rings in outlines:
+            painter.setPen(QPen(QColor.fromRgbF(*color), 1))
+            for ring in rings:
+                painter.drawPolyline(QPolygonF([QPointF(*p) for p in raster.toImage(ring) * self.scale]))
+        painter.end()
+        self.setPixmap(pixmap)
+
+    def mousePressEvent(self, event):
+        if self.raster is None or self.callback is None:
+            return
+        origin = self.contentsRect().topLeft()
+        px = event.position().x() - origin.x()
+        py = event.position().y() - origin.y()
+        if px < 0 or py < 0 or px >= self.pixmap().width() or py >= self.pixmap().height(): # outside the map
+            return
+        x, y = self.raster.fromImage(px / self.scale, py / self.scale)
+        self.callback(x, y)
+
+# window with the profile of the points of the cross-section: height against distance along the line
+class ProfileWindow(QWidget):
+    def __init__(self):
+        super(ProfileWindow, self).__init__()
+        self.setWindowTitle('Cross-Section Profile')
+        self.figure = Figure(figsize=(8, 3))
+        self.canvas = FigureCanvasQTAgg(self.figure)
+        self.axes = self.figure.add_subplot()
+        self.axes.set_xlabel('Distance along the line (m)')
+        self.axes.set_ylabel('Height (m)')
+        self.scatter = self.axes.scatter([], [], s=1)
+        self.layout = QGridLayout(self)
+        self.layout.addWidget(self.canvas, 0, 0)
+
+    def setProfile(self, along, z, colors):
+        self.scatter.set_offsets(np.column_stack([along, z]))
+        self.scatter.set_facecolors(colors)
+        if len(along):
+            self.axes.set_xlim(0, max(along.max(), 1e-3))
+            self.axes.set_ylim(z.min() - 0.5, z.max() + 0.5)
+        self.axes.set_title(str(len(along)) + ' points')
+        self.canvas.draw_idle()
+
+# outlines of all walls and structures, draped over the point cloud, as one polydata of polylines, so they are
+# drawn in one call per view; every view colors them by its own attribute, sharing the points and lines
+class OutlineOverlay(object):
+    def __init__(self, buffers, model, renderers, lift=0.1):
+        super(OutlineOverlay, self).__init__()
+
+        self.buffers = buffers
+
+        # rings resampled along their edges, so they follow the point cloud between their corners
+        rings = []
+        self.ringPolygons = [] # polygon of every ring, per shapefile
+        for shapefile in model.shapefiles.values():
+            polygons = []
+            for i, geometry in enumerate(shapefile['geometry']):
+                for ring in polygonRings(geometry):
+                    rings.append(self.densify(ring, model.groundModel.cellSize / 2))
+                    polygons.append(i)
+            self.ringPolygons.append(np.array(polygons, dtype=np.int64))
+        xy = np.concatenate(rings + [np.empty((0, 2))], axis=0)
+        # lifted a little above the highest points under them, so they are not hidden in the points
+        points = np.column_stack([xy, model.groundModel.topHeight(model.pc_array, xy) + lift])
+        offsets = np.concatenate([[0], np.cumsum([len(ring) for ring in rings])]).astype(np.int64)
+
+        lines = vtk.vtkCellArray()
+        lines.SetData(buffers.wrap('Outlines', offsets, True), buffers.wrap('Outlines', np.arange(len(xy), dtype=np.int64), True))
+        self.pd = vtk.vtkPolyData()
+        self.pd.SetPoints(buffers.points('Outlines', points))
+        self.pd.SetLines(lines)
+
+        self.views = [] # (polydata, actor) of every view
+        for renderer in renderers:
+            pd = vtk.vtkPolyData()
+            pd.ShallowCopy(self.pd) # own colors, shared points and lines
+            mapper = vtk.vtkPolyDataMapper()
+            mapper.SetInputDataObject(pd)
+            mapper.SetScalarModeToUseCellData()
+            mapper.SetColorModeToDirectScalars()
+            actor = vtk.vtkActor()
+            actor.SetMapper(mapper)
+            actor.GetProperty().SetLineWidth(2)
+            actor.VisibilityOff()
+            renderer.AddActor(actor)
+            self.views.append((pd, actor))
+
+    # returns the ring with points added along its edges, at most spacing apart
+    def densify(self, ring, spacing):
+        edges = np.diff(ring, axis=0)
+        counts = np.maximum(np.ceil(np.hypot(edges[:,0], edges[:,1]) / spacing), 1).astype(np.int64)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        fractions = (np.arange(counts.sum()) - starts) / np.repeat(counts, counts)
+        return np.vstack([np.repeat(ring[:-1], counts, axis=0) + np.repeat(edges, counts, axis=0) * fractions[:,None], ring[-1:]])
+
+    # colors the outlines of view k, given the color of every polygon of each shapefile
+    def setColors(self, k, polygonColors):
+        colors = np.concatenate([c[rings] for c, rings in zip(polygonColors, self.ringPolygons)] + [np.empty((0, 3))], axis=0)
+        pd, actor = self.views[k]
+        pd.GetCellData().SetScalars(self.buffers.wrap('Outlines', np.round(colors * 255).astype(np.uint8)))
+        pd.Modified()
+
+    def setVisible(self, visible):
+        for pd, actor in self.views:
+            actor.SetVisibility(visible)
 
 class Ui_MainWindow(object):
-    def setupUi(self, MainWindow):
+    def setupUi(self, MainWindow, nViews=1):
         MainWindow.setObjectName('The Main Window')
         MainWindow.setWindowTitle('Machu Llacta Visualization')
         # in Qt, windows are made of widgets.
@@ -118,14 +301,54 @@ class Ui_MainWindow(object):
 
         self.screenshotButton = QPushButton()
         self.screenshotButton.setText('Save Screenshot')
+        self.posterButton = QPushButton()
+        self.posterButton.setText('Save Poster')
+        self.exportButton = QPushButton()
+        self.exportButton.setText('Export Tiles')
+        self.selectionButton = QPushButton()
+        self.selectionButton.setText('Export Selection')
         self.quitButton = QPushButton()
         self.quitButton.setText('Quit')
+        self.clipButton = QPushButton()
+        self.clipButton.setText('Clip Region')
+        self.clipButton.setCheckable(True)
+        self.sliceButton = QPushButton()
+        self.sliceButton.setText('Cross-Section')
+        self.sliceButton.setCheckable(True)
+        self.outlineButton = QPushButton()
+        self.outlineButton.setText('Show Outlines')
+        self.outlineButton.setCheckable(True)
 
         self.attributeLabel = QLabel('Attribute that is Visualized:')
         self.attributeDropdown = QComboBox()
-        self.attributes = ['None', 'Type of Wall/Structure', 'Completeness', 'Wall Thickness', 'Maximum Original Height', 'Maximum Conserved Height', 'Time of Construction']
+        self.attributes = list(SiteModel.attributes)
         self.attributeDropdown.addItems(self.attributes)
 
+        # attribute of each additional view in split view mode; the dropdown above sets the first view
+        self.viewLabels = []
+        self.viewDropdowns = []
+        for k in range(1, nViews):
+            self.viewLabels.append(QLabel('Attribute in View ' + str(k + 1) + ':'))
+            self.viewDropdowns.append(QComboBox())
+            self.viewDropdowns[-1].addItems(self.attributes)
+
+        # range of values shown for numerical attributes; the sliders go over the range in 1000 steps
+        self.rangeLabel = QLabel('Range of Values Shown:')
+        self.minSlider = QSlider(Qt.Orientation.Horizontal)
+        self.maxSlider = QSlider(Qt.Orientation.Horizontal)
+        for slider, value in [(self.minSlider, 0), (self.maxSlider, 1000)]:
+            slider.setRange(0, 1000)
+            slider.setValue(value)
+            slider.setEnabled(False)
+        self.rangeValueLabel = QLabel('')
+        self.rangeValueLabel.setAlignment(Qt.AlignmentFlag.AlignHCenter)
+
+        self.overviewLabel = QLabel('Overview (click to move there):')
+        self.overview = OverviewWidget()
+        self.densityButton = QPushButton()
+        self.densityButton.setText('Show Density')
+        self.densityButton.setCheckable(True)
+
         self.positionLabel = QLabel('Current (X,Y,Z) position: (0,0,0)')
         self.positionLabel.setAlignment(Qt.AlignmentFlag.AlignHCenter)
 
@@ -138,8 +361,24 @@ class Ui_MainWindow(object):
         self.gridlayout.addWidget(self.vtkWidget, 0, 0, y, x)
 
         self.gridlayout.addWidget(self.screenshotButton, 0, x, 1, 1)
+        self.gridlayout.addWidget(self.clipButton, 1, x, 1, 1)
+        self.gridlayout.addWidget(self.exportButton, 2, x, 1, 1)
+        self.gridlayout.addWidget(self.sliceButton, 3, x, 1, 1)
         self.gridlayout.addWidget(self.attributeLabel, 4, x, 1, 1)
         self.gridlayout.addWidget(self.attributeDropdown, 5, x, 1, 1)
+        self.gridlayout.addWidget(self.rangeLabel, 6, x, 1, 1)
+        self.gridlayout.addWidget(self.minSlider, 7, x, 1, 1)
+        self.gridlayout.addWidget(self.maxSlider, 8, x, 1, 1)
+        self.gridlayout.addWidget(self.rangeValueLabel, 9, x, 1, 1)
+        self.gridlayout.addWidget(self.selectionButton, 10, x, 1, 1)
+        self.gridlayout.addWidget(self.outlineButton, 11, x, 1, 1)
+        self.gridlayout.addWidget(self.posterButton, 12, x, 1, 1)
+        for k, (label, dropdown) in enumerate(zip(self.viewLabels, self.viewDropdowns)):
+            self.gridlayout.addWidget(label, 13 + 2*k, x, 1, 1)
+            self.gridlayout.addWidget(dropdown, 14 + 2*k, x, 1, 1)
+        self.gridlayout.addWidget(self.overviewLabel, y-21, x, 1, 1)
+        self.gridlayout.addWidget(self.overview, y-20, x, 14, 1)
+        self.gridlayout.addWidget(self.densityButton, y-6, x, 1, 1)
         self.gridlayout.addWidget(self.positionLabel, y-4, x, 1, 1)
         self.gridlayout.addWidget(self.quitButton, y-1, x, 1, 1)
         MainWindow.setCentralWidget(self.centralWidget)
@@ -149,17 +388,13 @@ class FinalProject(QMainWindow):
     def __init__(self, parent = None):
         QMainWindow.__init__(self, parent)
         self.ui = Ui_MainWindow()
-        self.ui.setupUi(self)
+        self.ui.setupUi(self, args.views)
 
         self.attributes = self.ui.attributes
 
         # defining variables
         self.currAttribute = 'None' # current attribute being visualized
 
-        # creates dictionaries for numerical and categorical datatypes with (category name string: [column name in walls shapefile string, column name in structures shapefile string]) key value pairs
-        self.numericalDict = {'Wall Thickness': ['grosor', 'grosor_1'], 'Maximum Original Height': ['alt_max', None], 'Maximum Conserved Height': ['alt_cons', 'alt']}
-        self.categoryDict = {'None': 'None', 'Type of Wall/Structure': ['clase_rev', 'design_co1'] , 'Completeness': ['preserva_1', 'preserva_1'], 'Time of Construction': [None, 'temp_con_2']}
-
         # defines colors used to visualize categorical attributes
         self.categoryColors = [(235, 172, 35), (184, 0, 88), (0, 140, 249), (0, 110, 0), (0, 187, 173), (209, 99, 230), (89, 84, 214), (178, 69, 2), (255, 146, 135), (0, 198, 248), (135, 133, 0), (0, 167, 108), (189, 189, 189), (251, 73, 176)]
         self.categoryColors = [tuple(j/255 for j in i) for i in self.categoryColors]
@@ -167,197 +402,453 @@ class FinalProject(QMainWindow):
         # defines colors used to visualize numerical attributes
         viridis = [[0.267004, 0.004874, 0.329415], [0.282656, 0.100196, 0.42216], [0.277134, 0.185228, 0.489898], [0.253935, 0.265254, 0.529983], [0.221989, 0.339161, 0.548752], [0.190631, 0.407061, 0.556089], [0.163625, 0.471133, 0.558148], [0.139147, 0.533812, 0.555298], [0.120565, 0.596422, 0.543611], [0.134692, 0.658636, 0.517649], [0.20803, 0.718701, 0.472873], [0.327796, 0.77398, 0.40664], [0.477504, 0.821444, 0.318195], [0.647257, 0.8584, 0.209861], [0.82494, 0.88472, 0.106217], [0.993248, 0.906157, 0.143936]]
 
-        # read in the shapefiles
-        self.shapefileWalls = gpd.read_file(args.walls)
-        self.shapefileStructures = gpd.read_file(args.structures)
-
-        # read in pointcloud data, build pointcloud array
-        self.pc = laspy.read(args.input)
-        self.pc_array = np.vstack([self.pc.x, self.pc.y, self.pc.z]).transpose()
-        if not args.all:
-            self.pc_array = self.pc_array[::100] # Randomly reducing the points by a factor of 100
-
-        # get colors for each point
-        self.colors = np.vstack([self.pc.red/2**16, self.pc.green/2**16, self.pc.blue/2**16]).transpose()
-
-        self.nCoords = self.pc_array.shape[0]
-        self.nElem = self.pc_array.shape[1]
-
-        # presort points into each wall component, so we do not have to do it everytime we change category
-        if args.wallsfile: # read in preprocessed points
-            with open(args.wallsfile, 'rb') as fp:
-                ptsWalls = pickle.load(fp)
-        elif args.boundaries: # process the points, based on either polygons or bounding boxes
-            ptsWalls = realBoundary(self.shapefileWalls, self.pc_array)
-        else:
-            ptsWalls = boundingBox(self.shapefileWalls, self.pc_array)
-
-        if args.structuresfile: # read in preprocessed points
-            with open(args.structuresfile, 'rb') as fp:
-                ptsStructures = pickle.load(fp)
-        elif args.boundaries: # process the points, based on either polygons or bounding boxes
-            ptsStructures = realBoundary(self.shapefileStructures, self.pc_array)
-        else:
-            ptsStructures = boundingBox(self.shapefileStructures, self.pc_array)
-
-        # remove wall entries that have no points in them
-        mask = sorted((i for i, pt in enumerate(ptsWalls) if len(pt) == 0), reverse=True)
-        for i in mask:
-            del ptsWalls[i]
-            self.shapefileWalls.drop(i, inplace=True)
-
-        # remove structure entries that have no points in them
-        mask = sorted((i for i, pt in enumerate(ptsStructures) if len(pt) == 0), reverse=True)
-        for i in mask:
-            del ptsStructures[i]
-            self.shapefileStructures.drop(i, inplace=True)
-
-        # add pts columns to walls shapefile and structures shapefile
-        self.shapefileWalls['pts'] = ptsWalls
-        self.shapefileStructures['pts'] = ptsStructures
-        del ptsWalls
-        del ptsStructures
-
-        # building the max height structure column
-        self.shapefileStructures['alt_muro'] = pd.to_numeric(self.shapefileStructures['alt_muro_1'], 'coerce')
-        self.shapefileStructures['alt'] = self.shapefileStructures[['alt_muro', 'altura_has', 'altura_h_1']].max(axis=1)
-
-        # change thickness from strings to numbers, and removing outliers / entry errors in column
-        self.shapefileStructures['grosor_1'] = pd.to_numeric(self.shapefileStructures['grosor_1'], 'coerce')
-        self.shapefileStructures.at[self.shapefileStructures[self.shapefileStructures['grosor_1'] == self.shapefileStructures['grosor_1'].max()]['grosor_1'].index[0], 'grosor_1'] /= 10 # fixing incorrectly labeled thickness
-        self.shapefileStructures.at[self.shapefileStructures[self.shapefileStructures['grosor_1'] == self.shapefileStructures['grosor_1'].max()]['grosor_1'].index[0], 'grosor_1'] /= 10 # fixing incorrectly labeled thickness
-        self.shapefileStructures.at[self.shapefileStructures[self.shapefileStructures['grosor_1'] == self.shapefileStructures['grosor_1'].max()]['grosor_1'].index[0], 'grosor_1'] /= 10 # fixing incorrectly labeled thickness
-
+        # the point cloud, polygons, point memberships and attribute layers
+        self.model = buildModel(args)
+        self.pc_array = self.model.pc_array
+        self.colors = self.model.colors
+        self.grid = self.model.grid
+
+        # attributes that only exist with some options, such as the distance to another epoch, or are left out to fit the memory budget
+        if self.model.attributes != self.attributes:
+            self.attributes[:] = self.model.attributes
+            for dropdown in [self.ui.attributeDropdown] + self.ui.viewDropdowns:
+                dropdown.clear()
+                dropdown.addItems(self.attributes)
+
+        # overview map, built while the point cloud was read, with the outlines in the colors of the first categories
+        self.outlines = [(self.categoryColors[k], [ring for geometry in shapefile['geometry'] for ring in polygonRings(geometry)])
+                         for k, shapefile in enumerate([self.model.shapefileWalls, self.model.shapefileStructures])]
+        self.ui.overview.setRaster(self.model.overview, self.outlines)
+        self.ui.overview.callback = self.overviewCallback
 
         self.ren = vtk.vtkRenderer()
 
+        # the arrays handed to VTK, shared between actors where possible and never copied
+        self.buffers = BufferManager(len(self.pc_array))
+
         # create actor will all points, with natural color
-        self.allPoints = VTKActorWrapper(self.pc_array, colors=self.colors)
-        self.ren.AddActor(self.allPoints.actor)
+        self.allPoints = VTKActorWrapper(self.buffers, 'None', self.pc_array, colors=self.colors)
+        self.allPoints.index = self.grid
+        if not args.outofcore: # otherwise the natural colors are paged in from disk at full resolution
+            self.ren.AddActor(self.allPoints.actor)
 
         # dict of lists containing the actors needed for each attribute
         self.attributeActorDict = dict()
 
+        # split view: every view has its own renderer, side by side, showing its own attribute through its own
+        # actors; all renderers share one camera, and the actors of the other views are mirrors of the actors of
+        # the first, so all views draw the same point and attribute buffers
+        self.views = [{'renderer': self.ren, 'attribute': 'None', 'actors': self.attributeActorDict}]
+        for k in range(1, args.views):
+            renderer = vtk.vtkRenderer()
+            renderer.SetActiveCamera(self.ren.GetActiveCamera())
+            if not args.outofcore:
+                renderer.AddActor(self.allPoints.mirror())
+            self.views.append({'renderer': renderer, 'attribute': 'None', 'actors': dict()})
+        for k, view in enumerate(self.views):
+            view['renderer'].SetViewport(k / len(self.views), 0, (k + 1) / len(self.views), 1)
+
+        # every point actor, so the clip region can be applied to all of them
+        self.pointWrappers = [self.allPoints]
+
+        # points and per point colors or values of every layer, used by the exporters
+        self.layers = self.model.layers
+
+        # the actor of each numerical attribute, drawing its points sorted by value
+        self.numericWrappers = dict()
+        # smallest and largest value of each numerical attribute, the ends of the range sliders
+        self.valueRanges = dict()
+        indexes = {id(self.pc_array): self.grid} # grid index over each points buffer shared by numerical layers
+
+        # for each categorical attribute, the legend entries toggled off; each category's points are contiguous in
+        # their own actor, listed in legend order before the legend, so a toggle is one visibility flag per view
+        self.hiddenCategories = dict()
+
         # create the actors for each attribute; we can then turn their visbility on and off
         for attribute in self.attributes:
             if attribute != 'None':
+                layer = self.layers[attribute]
+                for view in self.views:
+                    view['actors'][attribute] = []
+
                 # is a categorical attribute; will need a legend
-                if attribute in self.categoryDict.keys():
-                    if attribute == 'Type of Wall/Structure':
-                        self.masterListWalls = categorical_arrays(self.shapefileWalls, self.categoryDict[attribute][0])
-                        self.masterListStructures = categorical_arrays(self.shapefileStructures, self.categoryDict[attribute][1])
-                        self.masterList = self.masterListWalls | self.masterListStructures # merge the two together
-                    elif attribute == 'Completeness':
-                        self.masterListWalls = categorical_arrays(self.shapefileWalls, self.categoryDict[attribute][0])
-                        self.masterListStructures = categorical_arrays(self.shapefileStructures, self.categoryDict[attribute][1])
-                        self.masterList = dict()
-                        for c in self.masterListStructures.keys():
-                            self.masterList[c] = np.concatenate([self.masterListWalls[c], self.masterListStructures[c]], axis=0)
-                    elif attribute == 'Time of Construction':
-                        self.masterList = categorical_arrays(self.shapefileStructures, self.categoryDict[attribute][1])
-                    
-                    self.attributeActorDict[attribute] = []
-
-                    self.legendSquare = vtk.vtkCubeSource()
-                    self.legendSquare.Update()
-                    self.legend = vtk.vtkLegendBoxActor()
-                    self.legend.SetNumberOfEntries(len(self.masterList))
-                    i = 0
-                    for c, arr in self.masterList.items():
-                        actorTemp = VTKActorWrapper(arr)
+                if 'categories' in layer:
+                    self.hiddenCategories[attribute] = set()
+                    for i in range(len(layer['categories'])):
+                        arr = layer['points'][layer['offsets'][i]:layer['offsets'][i+1]] # view, the points are not copied
+                        actorTemp = VTKActorWrapper(self.buffers, attribute, arr)
+                        actorTemp.index = self.grid.subIndex(arr[:,0:2])
+                        self.pointWrappers.append(actorTemp)
                         actorTemp.actor.GetProperty().SetColor(self.categoryColors[i])
                         
-                        self.ren.AddActor(actorTemp.actor)
-                        self.attributeActorDict[attribute].append(actorTemp.actor)
+                        self.addPointActor(attribute, actorTemp)
 
-                        self.legend.SetEntry(i, self.legendSquare.GetOutput(), c, self.categoryColors[i])
-                        i += 1
+                    for view in self.views:
+                        legend = self.makeLegend(layer['categories'])
+                        view['renderer'].AddActor(legend)
+                        view['actors'][attribute].append(legend)
 
-                    self.legend.GetPositionCoordinate().SetCoordinateSystemToView()
-                    self.legend.GetPositionCoordinate().SetValue(0.5, -0.9)
-                    self.legend.GetPosition2Coordinate().SetCoordinateSystemToView()
-                    self.legend.GetPosition2Coordinate().SetValue(1, -0.5)
-                    self.legend.UseBackgroundOn()
-                    self.legend.SetBackgroundColor(1, 1, 1)
-
-                    self.ren.AddActor(self.legend)
-
-                    self.attributeActorDict[attribute].append(self.legend)
-
-                    for actor in self.attributeActorDict[attribute]:
-                        actor.VisibilityOff()
+                        for actor in view['actors'][attribute]:
+                            actor.VisibilityOff()
 
                 # is a numerical attribute; will need a colorbar
-                elif attribute in self.numericalDict.keys():
-                    if attribute == 'Wall Thickness' or attribute == 'Maximum Conserved Height':
-                        minValWalls, maxValWalls = self.shapefileWalls[self.numericalDict[attribute][0]].agg(['min', 'max'])
-                        minValStructures, maxValStructures = self.shapefileStructures[self.numericalDict[attribute][1]].agg(['min', 'max'])
-                        minVal = min(minValWalls, minValStructures)
-                        maxVal = max(maxValWalls, maxValStructures)
-                    
-                        values = []
-                        points = []
-
-                        for i in self.shapefileWalls.index:
-                            for pt in self.shapefileWalls['pts'][i]:
-                                values.append(self.shapefileWalls[self.numericalDict[attribute][0]][i])
-                                points.append(pt)
-                        for i in self.shapefileStructures.index:
-                            for pt in self.shapefileStructures['pts'][i]:
-                                values.append(self.shapefileStructures[self.numericalDict[attribute][1]][i])
-                                points.append(pt)
-
-                    elif attribute == 'Maximum Original Height':
-                        minVal, maxVal = self.shapefileWalls[self.numericalDict[attribute][0]].agg(['min', 'max'])
-
-                        values = []
-                        points = []
-
-                        for i in self.shapefileWalls.index:
-                            for pt in self.shapefileWalls['pts'][i]:
-                                values.append(self.shapefileWalls[self.numericalDict[attribute][0]][i])
-                                points.append(pt)
-
-                    self.attributeActorDict[attribute] = []
-
-                    actorTemp = VTKActorWrapper(np.asarray(points), colors=None, values=np.asarray(values))
+                else:
+                    minVal, maxVal = layer['range']
+
+                    # points drawn sorted by value, so the points within any range of values are a contiguous range of ids
+                    actorTemp = VTKActorWrapper(self.buffers, attribute, layer['points'], values=layer['values'], order=layer['order'])
+                    if id(layer['points']) not in indexes:
+                        indexes[id(layer['points'])] = self.grid.subIndex(layer['points'][:,0:2])
+                    actorTemp.index = indexes[id(layer['points'])]
+                    self.pointWrappers.append(actorTemp)
+                    self.numericWrappers[attribute] = actorTemp
+                    # missing values are sorted last, so both ends are found by binary search through the order
+                    nValues = searchOrdered(layer['values'], layer['order'], np.inf, 'right')
+                    self.valueRanges[attribute] = (layer['values'][layer['order'][0]], layer['values'][layer['order'][nValues-1]]) if nValues else (np.nan, np.nan)
                     ctf = vtk.vtkColorTransferFunction()
                     for value, color in zip(np.linspace(minVal, maxVal, len(viridis)), viridis):
                         ctf.AddRGBPoint(value, *color)
                     actorTemp.mapper.SetLookupTable(ctf)
 
-                    self.ren.AddActor(actorTemp.actor)
-                    self.attributeActorDict[attribute].append(actorTemp.actor)
+                    self.addPointActor(attribute, actorTemp)
 
                     Colorbar_param = colorbar_param(title=attribute, pos=[0.9, 0.1], height=1000, width=150, nlabels=11)
-                    Colorbar = colorbar(ctf, Colorbar_param)
-                    self.ren.AddActor2D(Colorbar.get())
-                    self.attributeActorDict[attribute].append(Colorbar.get())
+                    for view in self.views:
+                        Colorbar = colorbar(ctf, Colorbar_param)
+                        view['renderer'].AddActor2D(Colorbar.get())
+                        view['actors'][attribute].append(Colorbar.get())
+
+                        for actor in view['actors'][attribute]:
+                            actor.VisibilityOff()
 
-                    for actor in self.attributeActorDict[attribute]:
-                        actor.VisibilityOff()
 
+        # outlines of the walls and structures over the points, colored by the attribute of each view
+        self.outlineOverlay = OutlineOverlay(self.buffers, self.model, [view['renderer'] for view in self.views])
+        for k in range(len(self.views)):
+            self.outlineOverlay.setColors(k, self.outlineColors('None'))
 
-        self.ui.vtkWidget.GetRenderWindow().AddRenderer(self.ren)
+        for layer, (held, shared) in self.buffers.report().items():
+            print('VTK buffers of ' + layer + ': ' + str(round(held / 2**20, 1)) + ' MB, and ' + str(round(shared / 2**20, 1)) + ' MB shared')
+
+        for view in self.views:
+            self.ui.vtkWidget.GetRenderWindow().AddRenderer(view['renderer'])
         self.iren = self.ui.vtkWidget.GetRenderWindow().GetInteractor()
 
+        # box widget used to pick the clip region; only the xy extent of the box is used
+        self.clipRep = vtk.vtkBoxRepresentation()
+        self.clipRep.SetPlaceFactor(1.0)
+        self.clipRep.PlaceWidget(self.allPoints.pd.GetBounds())
+        self.clipWidget = vtk.vtkBoxWidget2()
+        self.clipWidget.SetInteractor(self.iren)
+        self.clipWidget.SetRepresentation(self.clipRep)
+        self.clipWidget.RotationEnabledOff()
+        self.clipWidget.AddObserver('InteractionEvent', self.clipCallback)
+
+        # out-of-core mode: the full point cloud is cut into tiles on disk once, and the tiles in view are paged in
+        # whenever the camera stops, within the memory cap
+        self.pager = None
+        if args.outofcore:
+            index = buildTileStore(args.input, args.outofcore, args.tilesize)
+            self.pager = TilePager(args.outofcore, index, [view['renderer'] for view in self.views], args.pagecap * 2**20)
+            self.ren.ResetCamera(self.pager.storeBounds())
+            self.iren.AddObserver('EndInteractionEvent', self.pageCallback)
+
+        # line drawn on the cloud for cross-sections; the points near the vertical plane through it are shown in
+        # the profile window, updated while the line is dragged
+        bounds = self.allPoints.pd.GetBounds()
+        self.sliceRep = vtk.vtkLineRepresentation()
+        self.sliceRep.SetPoint1WorldPosition([(3 * bounds[0] + bounds[1]) / 4, (bounds[2] + bounds[3]) / 2, bounds[5]])
+        self.sliceRep.SetPoint2WorldPosition([(bounds[0] + 3 * bounds[1]) / 4, (bounds[2] + bounds[3]) / 2, bounds[5]])
+        self.sliceWidget = vtk.vtkLineWidget2()
+        self.sliceWidget.SetInteractor(self.iren)
+        self.sliceWidget.SetRepresentation(self.sliceRep)
+        self.sliceWidget.AddObserver('InteractionEvent', self.sliceCallback)
+        self.profile = ProfileWindow()
+
+        # clicks on a legend entry toggle its category, before the interactor style sees them
+        self.legendClickTag = self.iren.AddObserver('LeftButtonPressEvent', self.legendClickCallback, 1.0)
+
+        # interactive level of detail: a random subset of every actor is drawn while the camera moves
+        if args.lod:
+            rng = np.random.default_rng(0)
+            for wrapper in self.pointWrappers:
+                wrapper.enableLOD(rng)
+            self.reducedWrappers = []
+            self.iren.AddObserver('StartInteractionEvent', self.startLODCallback)
+            self.iren.AddObserver('EndInteractionEvent', self.endLODCallback)
+
+    # adds the actor of a point wrapper to the first view and a mirror of it to every other view
+    def addPointActor(self, attribute, wrapper):
+        for view in self.views:
+            actor = wrapper.actor if view['renderer'] is self.ren else wrapper.mirror()
+            view['renderer'].AddActor(actor)
+            view['actors'][attribute].append(actor)
+
+    # returns the color of every polygon of each shapefile for the outlines: the color of its category or of its
+    # value on the color scale of attribute, or the color of its shapefile on the overview map where it has none
+    def outlineColors(self, attribute):
+        polygonColors = []
+        for k, name in enumerate(self.model.shapefiles):
+            values = self.model.polygonValues(name, attribute)
+            colors = np.tile(self.categoryColors[k], (len(values), 1))
+            known = ~np.isnan(values)
+            if attribute in self.hiddenCategories: # categorical
+                colors[known] = np.array(self.categoryColors)[values[known].astype(np.int64)]
+            elif attribute in self.numericWrappers:
+                ctf = self.numericWrappers[attribute].mapper.GetLookupTable()
+                colors[known] = np.array([ctf.GetColor(v) for v in values[known]]).reshape(-1, 3)
+            polygonColors.append(colors)
+        return polygonColors
+
+    # returns a legend box with one entry per category
+    def makeLegend(self, categories):
+        legendSquare = vtk.vtkCubeSource()
+        legendSquare.Update()
+        legend = vtk.vtkLegendBoxActor()
+        legend.SetNumberOfEntries(len(categories))
+        for i, c in enumerate(categories):
+            legend.SetEntry(i, legendSquare.GetOutput(), c, self.categoryColors[i])
+
+        legend.GetPositionCoordinate().SetCoordinateSystemToView()
+        legend.GetPositionCoordinate().SetValue(0.5, -0.9)
+        legend.GetPosition2Coordinate().SetCoordinateSystemToView()
+        legend.GetPosition2Coordinate().SetValue(1, -0.5)
+        legend.UseBackgroundOn()
+        legend.SetBackgroundColor(1, 1, 1)
+        return legend
+
     def screenshotCallback(self):
         save_frame(self.ui.vtkWidget.GetRenderWindow())
         
+    # renders the first view as a poster of about --postersize pixels wide, in tiles of the window size; the other
+    # views are not drawn meanwhile, and legends and colorbars are left out, as they would repeat in every tile
+    def posterCallback(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Save Poster', 'poster.png', 'PNG (*.png)')
+        if not path:
+            return
+        renderWindow = self.ui.vtkWidget.GetRenderWindow()
+        magnification = max(1, int(np.ceil(args.postersize / renderWindow.GetSize()[0])))
+
+        viewport = self.ren.GetViewport()
+        self.ren.SetViewport(0, 0, 1, 1)
+        for view in self.views[1:]:
+            view['renderer'].DrawOff()
+        overlays = [prop for prop in self.ren.GetViewProps() if not prop.IsA('vtkProp3D') and prop.GetVisibility()]
+        for prop in overlays:
+            prop.VisibilityOff()
+
+        width, height = renderPoster(renderWindow, self.ren, path, magnification)
+
+        for prop in overlays:
+            prop.VisibilityOn()
+        for view in self.views[1:]:
+            view['renderer'].DrawOn()
+        self.ren.SetViewport(viewport)
+        renderWindow.Render()
+        print(path + ': ' + str(width) + ' x ' + str(height) + ' poster saved')
+
+    def exportCallback(self):
+        directory = QFileDialog.getExistingDirectory(self, 'Export Tiles')
+        if directory:
+            exportTiles(directory, self.layers, args.tilesize)
+
+    # the walls/structures of the categories shown for the current categorical attribute, or None for all of them
+    def currentSelection(self):
+        if self.currAttribute not in self.hiddenCategories:
+            return None
+        columns = self.model.categoryDict[self.currAttribute]
+        return [(name, column, c) for i, c in enumerate(self.layers[self.currAttribute]['categories']) if i not in self.hiddenCategories[self.currAttribute]
+                for name, column in zip(['walls', 'structures'], columns) if column is not None]
+
+    def selectionCallback(self):
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Selection', '', 'LAS files (*.las);;PLY files (*.ply)')
+        if path:
+            exportSelection(path, self.model, self.currentSelection())
+
     def quitCallback(self):
         sys.exit()
+
+    def clipToggleCallback(self, checked):
+        if checked:
+            self.clipWidget.On()
+            self.clipCallback(None, None)
+        else:
+            self.clipWidget.Off()
+            for wrapper in self.pointWrappers:
+                wrapper.clip(None)
+            self.ui.vtkWidget.GetRenderWindow().Render()
+
+    def outlineToggleCallback(self, checked):
+        self.outlineOverlay.setVisible(checked)
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    def sliceToggleCallback(self, checked):
+        if checked:
+            self.sliceWidget.On()
+            self.profile.show()
+            self.sliceCallback(None, None)
+        else:
+            self.sliceWidget.Off()
+            self.profile.hide()
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    # extracts the points within --slicewidth of the vertical plane through the line, using the grid index
+    def sliceCallback(self, caller, ev):
+        ids, along = self.model.idsInSlab(self.sliceRep.GetPoint1WorldPosition(), self.sliceRep.GetPoint2WorldPosition(), args.slicewidth)
+        self.profile.setProfile(along, self.pc_array[ids,2], self.colors[ids] / 255)
+
+    # switches the visible actors to the fraction of their points that fits in the frame time budget
+    def startLODCallback(self, caller, ev):
+        # the last frame drawn before an interaction is always at full detail
+        renderTime = sum(view['renderer'].GetLastRenderTimeInSeconds() for view in self.views)
+        fraction = args.lod / 1000 / max(renderTime, 1e-6)
+        if fraction >= 1:
+            return
+        self.reducedWrappers = [wrapper for wrapper in self.pointWrappers if wrapper.isVisible()]
+        for wrapper in self.reducedWrappers:
+            wrapper.setDetail(fraction)
+
+    # restores full detail once the camera stops
+    def endLODCallback(self, caller, ev):
+        if len(self.reducedWrappers) == 0:
+            return
+        for wrapper in self.reducedWrappers:
+            wrapper.setDetail(1)
+        self.reducedWrappers = []
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    def pageCallback(self, caller, ev):
+        self.pager.update()
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    # moves the camera over the point clicked on the overview map, at ground height, keeping its direction and distance
+    def overviewCallback(self, x, y):
+        camera = self.ren.GetActiveCamera()
+        focalPoint = np.array(camera.GetFocalPoint())
+        target = np.array([x, y, self.model.groundModel.groundHeight(np.array([[x, y]]))[0]])
+        camera.SetPosition(*(np.array(camera.GetPosition()) + target - focalPoint))
+        camera.SetFocalPoint(*target)
+        self.ren.ResetCameraClippingRange()
+        self.ui.positionLabel.setText('Current (X,Y,Z) position:\n' + str(tuple(map(floor, camera.GetPosition()))))
+        if self.pager is not None:
+            self.pager.update()
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    def densityCallback(self, checked):
+        self.ui.overview.setRaster(self.model.overview, self.outlines, checked)
+
+    # toggles the category of the legend entry under the mouse, if any, in every view showing its attribute
+    def legendClickCallback(self, caller, ev):
+        x, y = self.iren.GetEventPosition()
+        renderer = self.iren.FindPokedRenderer(x, y)
+        view = next((view for view in self.views if view['renderer'] is renderer), None)
+        if view is None or view['attribute'] not in self.hiddenCategories:
+            return
+        attribute = view['attribute']
+        legend = view['actors'][attribute][-1]
+        x0, y0 = legend.GetPositionCoordinate().GetComputedDisplayValue(renderer)
+        x1, y1 = legend.GetPosition2Coordinate().GetComputedDisplayValue(renderer)
+        padding = legend.GetPadding()
+        if not (min(x0, x1) <= x <= max(x0, x1) and min(y0, y1) + padding <= y < max(y0, y1) - padding):
+            return
+
+        # entries are stacked from the top, with equal heights
+        nEntries = legend.GetNumberOfEntries()
+        i = min(int((max(y0, y1) - padding - y) * nEntries / (abs(y1 - y0) - 2 * padding)), nEntries - 1)
+        hidden = self.hiddenCategories[attribute]
+        if i in hidden:
+            hidden.remove(i)
+        else:
+            hidden.add(i)
+        for view in self.views:
+            actors = view['actors'][attribute]
+            if view['attribute'] == attribute:
+                actors[i].SetVisibility(i not in hidden)
+            if i in hidden:
+                actors[-1].SetEntryColor(i, 0.85, 0.85, 0.85) # greyed out
+            else:
+                actors[-1].SetEntryColor(i, self.categoryColors[i])
+        self.iren.GetCommand(self.legendClickTag).SetAbortFlag(1)
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    # restricts every point actor to the xy extent of the clip box
+    def clipCallback(self, caller, ev):
+        bounds = self.clipRep.GetBounds()
+        for wrapper in self.pointWrappers:
+            wrapper.clip(bounds[0:4])
+        self.ui.vtkWidget.GetRenderWindow().Render()
     
-    def attributeCallback(self, val):
-        if self.currAttribute != 'None': # turn off old actors if needed
-            for actor in self.attributeActorDict[self.currAttribute]:
+    # switches the actors of a view to another attribute
+    def showAttribute(self, view, val):
+        if view['attribute'] != 'None': # turn off old actors if needed
+            for actor in view['actors'][view['attribute']]:
                 actor.VisibilityOff()
         if val != 'None': # turn on new actors if needed
-             for actor in self.attributeActorDict[val]:
+             for actor in view['actors'][val]:
                 actor.VisibilityOn()
+             for i in self.hiddenCategories.get(val, ()): # categories toggled off in the legend stay off
+                view['actors'][val][i].VisibilityOff()
+        view['attribute'] = val
+        self.outlineOverlay.setColors(self.views.index(view), self.outlineColors(val))
 
+    def attributeCallback(self, val):
+        self.showAttribute(self.views[0], val)
         self.currAttribute = val
+
+        # the range sliders start over at the full range of the new attribute
+        for slider, value in [(self.ui.minSlider, 0), (self.ui.maxSlider, 1000)]:
+            slider.blockSignals(True)
+            slider.setValue(value)
+            slider.setEnabled(val in self.numericWrappers)
+            slider.blockSignals(False)
+        self.ui.rangeValueLabel.setText('')
+        for wrapper in self.numericWrappers.values():
+            wrapper.setIdRange(None)
+
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+    # sets the attribute of one of the additional views; the range sliders follow the first view
+    def viewAttributeCallback(self, k, val):
+        self.showAttribute(self.views[k], val)
         self.ui.vtkWidget.GetRenderWindow().Render()
 
+    # hides the points of the numerical attribute outside the range of the sliders
+    def rangeCallback(self, val):
+        wrapper = self.numericWrappers[self.currAttribute]
+        values = self.layers[self.currAttribute]['values']
+        order = self.layers[self.currAttribute]['order']
+        lowSlider, highSlider = sorted([self.ui.minSlider.value(), self.ui.maxSlider.value()])
+        if lowSlider == 0 and highSlider == 1000: # full range, including points without a value
+            wrapper.setIdRange(None)
+            self.ui.rangeValueLabel.setText('')
+        else:
+            minVal, maxVal = self.valueRanges[self.currAttribute]
+            low = minVal + (maxVal - minVal) * lowSlider / 1000
+            high = minVal + (maxVal - minVal) * highSlider / 1000
+            # the order sorts the values, so the range is found by binary search
+            wrapper.setIdRange(searchOrdered(values, order, low, 'left'), searchOrdered(values, order, high, 'right'))
+            self.ui.rangeValueLabel.setText('%0.2f to %0.2f' % (low, high))
+        self.ui.vtkWidget.GetRenderWindow().Render()
+
+# returns where value would be inserted in values[order], sorted, like np.searchsorted, without gathering the
+# sorted values; missing values are sorted last
+def searchOrdered(values, order, value, side):
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[order[mid]] < value or (side == 'right' and values[order[mid]] == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+# returns the site model for the command line options; no Qt or VTK object is created, so the headless exports
+# run without a display
+def buildModel(args):
+    return SiteModel(args.input, args.walls, args.structures, args.wallsfile, args.structuresfile, args.all, args.boundaries,
+                     args.raster, args.refine, args.groundcell, args.noground, args.insidestep, args.morton, args.incremental, args.epoch,
+                     args.max_memory * 2**20 if args.max_memory else None, args.max_gpu_points, args.shapecache, args.step)
+
 # used to update current location of camera on GUI
 def locationCallback(caller, ev):
     locationCallback.label.setText('Current (X,Y,Z) position:\n' + str(tuple(map(floor, locationCallback.cam.GetPosition()))))
@@ -367,15 +858,57 @@ if __name__ == '__main__':
     global args
 
     parser = argparse.ArgumentParser(description='CS53000 Final Project')
-    parser.add_argument('-i', '--input', required=True, type=str, help='Path of the point cloud dataset')
+    parser.add_argument('-i', '--input', required=True, type=str, help='Path of the point cloud dataset; a LAS file, a directory of LAS tiles or a glob of LAS tiles')
     parser.add_argument('-w', '--walls', required=True, type=str, help='Path of the Walls Shapefile')
     parser.add_argument('-s', '--structures', required=True, type=str, help='Path of the Structures Shapefile')
     parser.add_argument('--wallsfile', required=False, type=str, help='Path of the preprocessed points pkl file for walls')
     parser.add_argument('--structuresfile', required=False, type=str, help='Path of the preprocessed points pkl file for structures')
     parser.add_argument('-a', '--all', action='store_true', help='Use all points instead of reducing')
+    parser.add_argument('--step', required=False, type=int, help='Keep every step-th point instead of every 100th; with --insidestep, of the points outside the wall/structure polygons')
     parser.add_argument('-b', '--boundaries', action='store_true', help='Calculate and use actual wall boundaries instead of bounding boxes')
+    parser.add_argument('-r', '--raster', required=False, type=float, help='Classify points with a label raster of the polygons, with cells of this size in meters')
+    parser.add_argument('--refine', action='store_true', help='With --raster, test the points in boundary cells against the actual polygons, matching -b')
+    parser.add_argument('--groundcell', required=False, type=float, default=2.0, help='Cell size in meters of the ground model used for heights above ground')
+    parser.add_argument('--noground', required=False, type=float, help='Drop the points lower than this height in meters above the ground model')
+    parser.add_argument('--lod', required=False, type=float, help='Frame time budget in milliseconds; while the camera moves, only a random subset of the points that fits in it is drawn')
+    parser.add_argument('--export', required=False, type=str, help='Export the point cloud and attribute layers as tiles to this directory, then exit')
+    parser.add_argument('--tilesize', required=False, type=float, default=50.0, help='Size in meters of the exported tiles')
+    parser.add_argument('--extract', required=False, type=str, help='Export the points of the walls/structures given by --select to this LAS or PLY file, then exit')
+    parser.add_argument('--select', required=False, type=str, action='append', help="With --extract, walls/structures to export, as 'walls:COLUMN=VALUE' or 'structures:COLUMN=VALUE'; may be repeated, all of them if not given")
+    parser.add_argument('--incremental', required=False, type=str, help='Path of the membership cache; only polygons that changed since the cached run are classified')
+    parser.add_argument('--insidestep', required=False, type=int, help='Reduce the points within the wall/structure polygons by this factor only, e.g. 1 to keep all of them, while the rest of the cloud is reduced as usual')
+    parser.add_argument('--morton', action='store_true', help='Reorder the points along a Z-order curve after reading them, so nearby points are contiguous in memory')
+    parser.add_argument('--outofcore', required=False, type=str, help='Directory of the tile store; the full point cloud is cut into tiles there once, and only the tiles in view are paged in')
+    parser.add_argument('--pagecap', required=False, type=float, default=1024, help='With --outofcore, memory cap in MB of the resident tiles')
+    parser.add_argument('--epoch', required=False, type=str, help='Path of the point cloud of another survey epoch; adds the distance from every point to the nearest point of that epoch as an attribute')
+    parser.add_argument('--postersize', required=False, type=int, default=16384, help='Width in pixels of the posters saved by Save Poster, rounded up to a whole number of window widths')
+    parser.add_argument('--slicewidth', required=False, type=float, default=0.25, help='Distance in meters from the cross-section plane of the points shown in the profile')
+    parser.add_argument('--shapecache', required=False, type=str, default='cache', help='Directory of the attribute store of the shapefiles, reused while they are unchanged')
+    parser.add_argument('--max-memory', required=False, type=float, help='Memory budget in MB; the point reduction and layers are picked from the LAS headers to fit it, overriding -a and --step')
+    parser.add_argument('--max-gpu-points', required=False, type=int, help='Budget of points drawn at once; the point reduction and layers are picked from the LAS headers to fit it, overriding -a and --step')
+    parser.add_argument('--views', required=False, type=int, default=1, help='Number of side by side views with linked cameras, each showing its own attribute')
 
     args = parser.parse_args()
+    if args.step and args.all:
+        parser.error('-a keeps every point; use either -a or --step')
+    if args.outofcore and (args.all or args.step == 1): # the full cloud is paged in from the tile store, the layers use the reduced cloud
+        parser.error('--outofcore draws the full point cloud from its tile store; use a reduced cloud (no -a or --step 1), or --max-memory to pick the reduction')
+    if args.incremental and args.raster and not args.refine: # cached and new memberships must not depend on each other
+        parser.error('--incremental with --raster needs --refine: without it, a cell covered by overlapping polygons goes to the last one rasterized, which depends on the polygons classified together')
+
+    if args.export: # headless export, before any window is created
+        exportTiles(args.export, buildModel(args).layers, args.tilesize)
+        sys.exit()
+    if args.extract: # headless export of a selection, before any window is created
+        selections = None
+        if args.select:
+            selections = []
+            for selection in args.select:
+                name, condition = selection.split(':', 1)
+                column, value = condition.split('=', 1)
+                selections.append((name, column, value))
+        exportSelection(args.extract, buildModel(args), selections)
+        sys.exit()
 
     app = QApplication([])
     window = FinalProject()
@@ -385,13 +918,26 @@ if __name__ == '__main__':
     window.iren.Initialize() # Need this line to actually show the render inside Qt
 
     window.ui.screenshotButton.clicked.connect(window.screenshotCallback)
+    window.ui.exportButton.clicked.connect(window.exportCallback)
+    window.ui.selectionButton.clicked.connect(window.selectionCallback)
     window.ui.quitButton.clicked.connect(window.quitCallback)
+    window.ui.clipButton.toggled.connect(window.clipToggleCallback)
+    window.ui.densityButton.toggled.connect(window.densityCallback)
+    window.ui.sliceButton.toggled.connect(window.sliceToggleCallback)
+    window.ui.outlineButton.toggled.connect(window.outlineToggleCallback)
+    window.ui.posterButton.clicked.connect(window.posterCallback)
     window.ui.attributeDropdown.currentTextChanged.connect(window.attributeCallback)
+    window.ui.minSlider.valueChanged.connect(window.rangeCallback)
+    window.ui.maxSlider.valueChanged.connect(window.rangeCallback)
+    for k, dropdown in enumerate(window.ui.viewDropdowns, 1):
+        dropdown.currentTextChanged.connect(partial(window.viewAttributeCallback, k))
 
     # make camera location GUI widget change whenever camera finishes changing
     locationCallback.cam = window.ren.GetActiveCamera()
     locationCallback.label = window.ui.positionLabel
     window.iren.AddObserver('EndInteractionEvent', locationCallback)
+    if window.pager is not None:
+        window.pageCallback(None, None)
     window.ui.positionLabel.setText('Current (X,Y,Z) position:\n' + str(tuple(map(floor, window.ren.GetActiveCamera().GetPosition()))))
     
     sys.exit(app.exec())
\ No newline at end of file
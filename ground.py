@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from spatial_index import Grid
+'''
+Helper class to estimate the terrain under the point cloud
+'''
+class GroundModel(Grid):
+    # estimates the ground as the lowest point in each cell of a 2D grid; empty cells are filled from their
+    # neighbours, the surface is smoothed with a 3x3 mean and interpolated bilinearly between cell centers
+    def __init__(self, pc_array, cellSize=2.0, smoothing=2):
+        super(GroundModel, self).__init__(pc_array[:,0:2].min(axis=0), cellSize, maxs=pc_array[:,0:2].max(axis=0))
+
+        # lowest point of every cell, in one grouped pass over the points
+        zmin = pd.Series(pc_array[:,2]).groupby(self.cellOf(pc_array[:,0:2])).min()
+        ground = np.full(self.shape[0] * self.shape[1], np.nan)
+        ground[zmin.index.values] = zmin.values
+        ground = ground.reshape(self.shape)
+
+        # grow the surface into the empty cells, averaging the known neighbours of each
+        while np.isnan(ground).any():
+            sums, counts = self.neighbourSums(np.nan_to_num(ground), (~np.isnan(ground)).astype(np.float64))
+            fill = np.isnan(ground) & (counts > 0)
+            ground[fill] = sums[fill] / counts[fill]
+
+        for i in range(smoothing):
+            sums, counts = self.neighbourSums(ground, np.ones(self.shape))
+            ground = sums / counts
+        self.ground = ground
+
+    # returns the sum of values and weights over the 3x3 neighbourhood of every cell
+    def neighbourSums(self, values, weights):
+        values = np.pad(values * weights, 1)
+        weights = np.pad(weights, 1)
+        sums = np.zeros(self.shape)
+        counts = np.zeros(self.shape)
+        for dy in range(3):
+            for dx in range(3):
+                sums += values[dy:dy+self.shape[0], dx:dx+self.shape[1]]
+                counts += weights[dy:dy+self.shape[0], dx:dx+self.shape[1]]
+        return sums, counts
+
+    # returns the ground height under each point, interpolated between the four nearest cell centers
+    def groundHeight(self, xy):
+        fx = np.clip((xy[:,0] - self.origin[0]) / self.cellSize - 0.5, 0, self.shape[1] - 1)
+        fy = np.clip((xy[:,1] - self.origin[1]) / self.cellSize - 0.5, 0, self.shape[0] - 1)
+        ix = np.minimum(fx.astype(np.int64), max(self.shape[1] - 2, 0))
+        iy = np.minimum(fy.astype(np.int64), max(self.shape[0] - 2, 0))
+        tx = fx - ix
+        ty = fy - iy
+        ix1 = np.minimum(ix + 1, self.shape[1] - 1)
+        iy1 = np.minimum(iy + 1, self.shape[0] - 1)
+        g = self.ground
+        return (g[iy, ix] * (1 - tx) + g[iy, ix1] * tx) * (1 - ty) + (g[iy1, ix] * (1 - tx) + g[iy1, ix1] * tx) * ty
+
+    def heightAboveGround(self, pc_array):
+        return pc_array[:,2] - self.groundHeight(pc_array[:,0:2])
+
+    # returns the height of the highest point of pc_array in the cell of each of xy, or the ground height where
+    # the cell has no point, e.g. to drape lines over the point cloud
+    def topHeight(self, pc_array, xy):
+        zmax = pd.Series(pc_array[:,2]).groupby(self.cellOf(pc_array[:,0:2])).max()
+        top = np.full(self.shape[0] * self.shape[1], np.nan)
+        top[zmax.index.values] = zmax.values
+        heights = top[self.cellOf(xy)]
+        return np.where(np.isnan(heights), self.groundHeight(xy), heights)
@@ -0,0 +1,53 @@
+import numpy as np
+import laspy
+from spatial_index import Grid
+'''
+Helper class for the top-down overview map of the point cloud
+'''
+class OverviewRaster(Grid):
+    # 2D raster of the number of points and their mean color over the xy extent given by the LAS headers, so
+    # it can be filled chunk by chunk while the point cloud is read; the longest side has size cells
+    def __init__(self, paths, size=512):
+        mins = []
+        maxs = []
+        for path in paths:
+            with laspy.open(path) as fp:
+                mins.append(fp.header.mins[0:2])
+                maxs.append(fp.header.maxs[0:2])
+        origin = np.min(mins, axis=0)
+        extent = np.maximum(np.max(maxs, axis=0) - origin, 1e-9)
+        super(OverviewRaster, self).__init__(origin, float(extent.max() / size), maxs=origin + extent)
+
+        self.counts = np.zeros(self.shape[0] * self.shape[1], dtype=np.int64)
+        self.colorSums = np.zeros((self.shape[0] * self.shape[1], 3), dtype=np.float64)
+
+    # returns the number of points and the sum of their 8 bit colors in every cell, for one chunk of points
+    def binPoints(self, xyz, colors):
+        cells = self.cellOf(xyz)
+        size = self.shape[0] * self.shape[1]
+        counts = np.bincount(cells, minlength=size)
+        colorSums = np.stack([np.bincount(cells, colors[:,k], minlength=size) for k in range(3)], axis=1)
+        return counts, colorSums
+
+    def add(self, binned):
+        counts, colorSums = binned
+        self.counts += counts
+        self.colorSums += colorSums
+
+    # returns the raster as an 8 bit (rows, columns, 3) image with north up: the mean color of every cell, or the
+    # point density on a log scale
+    def image(self, density=False):
+        counts = self.counts.reshape(self.shape)
+        if density:
+            level = np.log1p(counts) / max(np.log1p(counts.max()), 1e-9)
+            image = np.repeat(level[:,:,None], 3, axis=2)
+        else:
+            image = self.colorSums.reshape(self.shape + (3,)) / 255 / np.maximum(counts, 1)[:,:,None]
+        return np.ascontiguousarray(np.round(image[::-1] * 255).astype(np.uint8))
+
+    # converts between xy coordinates and (column, row) of the image
+    def toImage(self, xy):
+        return np.stack([(xy[:,0] - self.origin[0]) / self.cellSize, self.shape[0] - (xy[:,1] - self.origin[1]) / self.cellSize], axis=1)
+
+    def fromImage(self, column, row):
+        return self.origin[0] + column * self.cellSize, self.origin[1] + (self.shape[0] - row) * self.cellSize
@@ -0,0 +1,184 @@
+import os
+import json
+import collections
+import numpy as np
+import laspy
+import vtk
+import vtk.util.numpy_support as vtk_np
+import concurrent.futures
+from pointcloud import lasPaths, chunkTasks, cloudSignature
+from spatial_index import tileGroups
+'''
+Out-of-core paging of the point cloud, for clouds larger than memory.
+
+buildTileStore cuts the cloud into square tiles on the xy plane, streaming the LAS chunks to one pair of
+little-endian files per tile:
+    x_y.xyz     float32 x, y, z per point, relative to the offset in index.json
+    x_y.rgb     uint8 r, g, b per point
+TilePager memory-maps the tiles in the view frustum and hands the mapped arrays to VTK without copying them;
+tiles that left the view stay resident until the memory cap is reached, and are then evicted least recently used first.
+'''
+# bytes of the mapped arrays of one point
+BYTES_PER_POINT = 15
+
+# decodes one chunk of a LAS file and splits its points by tile
+def readTileChunk(task):
+    (path, start, count, step, _), offset, tileSize = task
+    with laspy.open(path) as fp:
+        fp.seek(start)
+        pts = fp.read_points(count)
+    xyz = np.vstack([pts.x - offset[0], pts.y - offset[1], pts.z - offset[2]]).transpose()[::step].astype(np.float32)
+    rgb = np.vstack([pts.red >> 8, pts.green >> 8, pts.blue >> 8]).transpose()[::step].astype(np.uint8)
+    return [(tx, ty, xyz[ids], rgb[ids]) for tx, ty, ids in tileGroups(xyz, tileSize)]
+
+# writes the tile store of the cloud at path (file, directory or glob of tiles) keeping every step-th point, and
+# returns its index; a store already built from the same files is reused. Chunks are decoded by a process pool
+# with a bounded number of chunks in flight, and their points appended to the tile files, so memory stays bounded
+def buildTileStore(path, outdir, tileSize=50.0, step=1, workers=None):
+    os.makedirs(outdir, exist_ok=True)
+    indexPath = os.path.join(outdir, 'index.json')
+    signature = json.loads(json.dumps(cloudSignature(path, step)))
+    if os.path.exists(indexPath):
+        with open(indexPath) as fp:
+            index = json.load(fp)
+        if index['signature'] == signature and index['tileSize'] == tileSize:
+            return index
+        os.remove(indexPath) # the index is written last, so a store without one is never trusted
+
+    for name in os.listdir(outdir):
+        if name.endswith(('.xyz', '.rgb')):
+            os.remove(os.path.join(outdir, name))
+
+    paths = lasPaths(path)
+    mins = []
+    for p in paths:
+        with laspy.open(p) as fp:
+            mins.append(fp.header.mins)
+    offset = np.min(mins, axis=0)
+
+    tiles = dict() # (x, y): [points, mins, maxs]
+    def append(result):
+        for tx, ty, xyz, rgb in result:
+            name = str(tx) + '_' + str(ty)
+            with open(os.path.join(outdir, name + '.xyz'), 'ab') as fp:
+                fp.write(np.ascontiguousarray(xyz, dtype='<f4').tobytes())
+            with open(os.path.join(outdir, name + '.rgb'), 'ab') as fp:
+                fp.write(np.ascontiguousarray(rgb).tobytes())
+            tile = tiles.setdefault((tx, ty), [0, xyz.min(axis=0), xyz.max(axis=0)])
+            tile[0] += len(xyz)
+            tile[1] = np.minimum(tile[1], xyz.min(axis=0))
+            tile[2] = np.maximum(tile[2], xyz.max(axis=0))
+
+    workers = workers or os.cpu_count()
+    maxInFlight = 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        inFlight = collections.deque()
+        for task in chunkTasks(paths, step):
+            inFlight.append(executor.submit(readTileChunk, (task, offset, tileSize)))
+            if len(inFlight) >= maxInFlight:
+                append(inFlight.popleft().result())
+        for future in inFlight:
+            append(future.result())
+
+    index = {'version': 1, 'signature': signature, 'offset': [float(v) for v in offset], 'tileSize': tileSize,
+             'tiles': [{'x': tx, 'y': ty, 'file': str(tx) + '_' + str(ty), 'points': int(points),
+                        'bounds': [float(v) for v in np.concatenate([tmin, tmax])]}
+                       for (tx, ty), (points, tmin, tmax) in sorted(tiles.items())]}
+    with open(indexPath, 'w') as fp:
+        json.dump(index, fp)
+    return index
+
+class TilePager(object):
+    # pages the tiles of the store in outdir into the renderers, keeping at most maxBytes of tiles resident
+    def __init__(self, outdir, index, renderers, maxBytes):
+        super(TilePager, self).__init__()
+
+        self.outdir = outdir
+        self.renderers = renderers
+        self.maxBytes = maxBytes
+        self.offset = np.array(index['offset'])
+        self.files = [tile['file'] for tile in index['tiles']]
+        self.points = np.array([tile['points'] for tile in index['tiles']], dtype=np.int64)
+        self.bounds = np.array([tile['bounds'] for tile in index['tiles']]).reshape(-1, 6) + np.tile(self.offset, 2) # xmin, ymin, zmin, xmax, ymax, zmax
+
+        # the cells of a tile are views into one shared range of ids, so they cost nothing per tile
+        self.ids = np.arange(self.points.max() + 1 if len(self.points) else 1, dtype=np.int64)
+
+        self.resident = collections.OrderedDict() # tile: actors, least recently used first
+        self.residentBytes = 0
+
+    # bounds of the whole store, (xmin, xmax, ymin, ymax, zmin, zmax) as VTK uses them
+    def storeBounds(self):
+        mins = self.bounds[:,0:3].min(axis=0)
+        maxs = self.bounds[:,3:6].max(axis=0)
+        return [v for pair in zip(mins, maxs) for v in pair]
+
+    # returns one actor per renderer drawing the memory-mapped points of a tile
+    def loadTile(self, i):
+        nPoints = int(self.points[i])
+        xyz = np.memmap(os.path.join(self.outdir, self.files[i] + '.xyz'), dtype='<f4', mode='r', shape=(nPoints, 3))
+        rgb = np.memmap(os.path.join(self.outdir, self.files[i] + '.rgb'), dtype=np.uint8, mode='r', shape=(nPoints, 3))
+
+        verts = vtk.vtkPoints()
+        verts.SetData(vtk_np.numpy_to_vtk(xyz))
+        cells = vtk.vtkCellArray()
+        cells.SetData(vtk_np.numpy_to_vtkIdTypeArray(self.ids[0:nPoints+1]), vtk_np.numpy_to_vtkIdTypeArray(self.ids[0:nPoints]))
+        pd = vtk.vtkPolyData()
+        pd.SetPoints(verts)
+        pd.SetVerts(cells)
+        pd.GetPointData().SetScalars(vtk_np.numpy_to_vtk(rgb))
+
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputDataObject(pd)
+        mapper.SetColorModeToDirectScalars()
+        actors = []
+        for renderer in self.renderers:
+            actor = vtk.vtkActor()
+            actor.SetMapper(mapper)
+            actor.GetProperty().SetRepresentationToPoints()
+            actor.SetPosition(*self.offset) # the points are stored relative to the offset
+            renderer.AddActor(actor)
+            actors.append(actor)
+        return actors
+
+    def evictTile(self, i):
+        for renderer, actor in zip(self.renderers, self.resident.pop(i)):
+            renderer.RemoveActor(actor)
+        self.residentBytes -= int(self.points[i]) * BYTES_PER_POINT
+
+    # returns whether each tile intersects the view frustum of the camera of the first renderer
+    def visibleTiles(self):
+        renderer = self.renderers[0]
+        planes = [0.0] * 24
+        renderer.GetActiveCamera().GetFrustumPlanes(renderer.GetTiledAspectRatio(), planes)
+        planes = np.array(planes).reshape(6, 4) # normals point inside the frustum
+        # a box is outside a plane if its corner furthest along the normal is outside
+        corners = np.where(planes[:,None,0:3] > 0, self.bounds[None,:,3:6], self.bounds[None,:,0:3])
+        return ((corners * planes[:,None,0:3]).sum(axis=2) + planes[:,None,3] >= 0).all(axis=0)
+
+    # pages in the tiles in view, nearest first, and evicts the least recently used tiles over the memory cap
+    def update(self):
+        camera = np.array(self.renderers[0].GetActiveCamera().GetPosition())
+        centers = (self.bounds[:,0:3] + self.bounds[:,3:6]) / 2
+        visible = np.flatnonzero(self.visibleTiles())
+        visible = visible[np.argsort(np.linalg.norm(centers[visible] - camera, axis=1))]
+
+        wanted = set()
+        wantedBytes = 0
+        for i in visible:
+            tileBytes = int(self.points[i]) * BYTES_PER_POINT
+            if wantedBytes + tileBytes > self.maxBytes and wanted:
+                break
+            wanted.add(i)
+            wantedBytes += tileBytes
+            if i in self.resident:
+                self.resident.move_to_end(i)
+            else:
+                self.resident[i] = self.loadTile(i)
+                self.residentBytes += tileBytes
+
+        for i in list(self.resident):
+            if self.residentBytes <= self.maxBytes:
+                break
+            if i not in wanted:
+                self.evictTile(i)
@@ -0,0 +1,128 @@
+import os
+import glob
+import numpy as np
+import laspy
+import concurrent.futures
+'''
+Helper functions to read the point cloud, from one LAS file or from a set of LAS tiles
+'''
+# number of points decoded by one process at a time
+CHUNK_SIZE = 5000000
+
+# returns the sorted LAS files given a single file, a directory of tiles or a glob pattern
+def lasPaths(path):
+    if os.path.isdir(path):
+        paths = [p for p in glob.glob(os.path.join(path, '*')) if p.lower().endswith(('.las', '.laz'))]
+    elif glob.has_magic(path):
+        paths = glob.glob(path)
+    else:
+        paths = [path]
+    if len(paths) == 0:
+        raise FileNotFoundError('No LAS files found for ' + path)
+    return sorted(paths)
+
+# identifies the points read by loadPointCloud, so point ids cached from an earlier run can be trusted
+def cloudSignature(path, step, insideStep=None):
+    return [(os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)) for p in lasPaths(path)], step, insideStep
+
+# splits every file into chunks made of whole decimation steps, so each chunk can be decoded by a separate process
+# and decimating each chunk gives the same points as decimating the whole file
+def chunkTasks(paths, step, chunkSize=CHUNK_SIZE, insideStep=None):
+    size = max(chunkSize // step, 1) * step
+    tasks = []
+    for path in paths:
+        with laspy.open(path) as fp:
+            nPoints = fp.header.point_count
+        for start in range(0, nPoints, size):
+            tasks.append((path, start, min(size, nPoints - start), step, insideStep))
+    return tasks
+
+# per-process classifiers and overview raster, sent once to each worker instead of with every chunk
+_classifiers = []
+_overview = None
+
+def _initWorker(classifiers, overview=None):
+    global _classifiers, _overview
+    _classifiers = classifiers
+    _overview = overview
+
+# returns the colors of the LAS points pts as contiguous 8 bit RGBA, the layout VTK draws without a copy
+def rgbaColors(pts):
+    rgba = np.empty((len(pts), 4), dtype=np.uint8)
+    rgba[:,0] = pts.red >> 8
+    rgba[:,1] = pts.green >> 8
+    rgba[:,2] = pts.blue >> 8
+    rgba[:,3] = 255
+    return rgba
+
+# decodes, decimates and classifies one chunk of a LAS file, and bins all its points into the overview raster
+# with an insideStep, the whole chunk is classified first, and the points within a polygon are decimated by
+# insideStep instead of step; the ids found are renumbered to the points kept
+def readChunk(task):
+    path, start, count, step, insideStep = task
+    with laspy.open(path) as fp:
+        fp.seek(start)
+        pts = fp.read_points(count)
+    xyz = np.vstack([pts.x, pts.y, pts.z]).transpose()
+    colors = rgbaColors(pts)
+    binned = None
+    if _overview is not None: # from all points of the chunk, before decimation
+        binned = _overview.binPoints(xyz, colors)
+    if insideStep is None:
+        xyz = xyz[::step]
+        return xyz, colors[::step], [classify(xyz) for classify in _classifiers], binned
+
+    memberships = [classify(xyz) for classify in _classifiers]
+    inside = np.zeros(count, dtype=bool)
+    for ids in memberships:
+        for idx in ids:
+            inside[idx] = True
+    position = np.arange(start, start + count) # decimation follows the position in the file, as with step alone
+    keep = (position % step == 0) | (inside & (position % insideStep == 0))
+    newIds = np.cumsum(keep) - 1
+    return xyz[keep], colors[keep], [[newIds[idx[keep[idx]]] for idx in ids] for ids in memberships], binned
+
+# reads the point cloud at path (file, directory or glob of tiles) keeping every step-th point, with its colors
+# as 8 bit RGBA
+# chunks are decoded in a process pool; each classifier maps the points of a chunk to a list of point ids
+# per polygon, and the per-chunk lists are merged into ids over the whole cloud
+# with an insideStep, the points within any polygon of the classifiers keep every insideStep-th point instead;
+# an OverviewRaster passed as overview is filled with all points read, as a by-product; workers and chunkSize
+# bound the points decoded at once, by default one chunk of CHUNK_SIZE points per processor
+def loadPointCloud(path, step=1, classifiers=(), insideStep=None, overview=None, workers=None, chunkSize=CHUNK_SIZE):
+    tasks = chunkTasks(lasPaths(path), step, chunkSize, insideStep)
+    chunkIds = [[] for classify in classifiers]
+
+    if insideStep is None:
+        sizes = [len(range(0, count, step)) for _, _, count, _, _ in tasks]
+        offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+        # filled in place as the chunks arrive, so the chunks are never held twice
+        pc_array = np.empty((offsets[-1], 3), dtype=np.float64)
+        colors = np.empty((offsets[-1], 4), dtype=np.uint8)
+    else: # the size of a chunk is only known once it is classified
+        offsets = [0]
+        xyzChunks = []
+        rgbChunks = []
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_initWorker, initargs=(list(classifiers), overview)) as executor:
+        for i, (xyz, rgb, memberships, binned) in enumerate(executor.map(readChunk, tasks)):
+            if binned is not None:
+                overview.add(binned)
+            if insideStep is None:
+                pc_array[offsets[i]:offsets[i+1]] = xyz
+                colors[offsets[i]:offsets[i+1]] = rgb
+            else:
+                offsets.append(offsets[i] + len(xyz))
+                xyzChunks.append(xyz)
+                rgbChunks.append(rgb)
+            for k, ids in enumerate(memberships):
+                chunkIds[k].append([idx + offsets[i] for idx in ids])
+
+    if insideStep is not None:
+        pc_array = np.concatenate(xyzChunks, axis=0)
+        colors = np.concatenate(rgbChunks, axis=0)
+
+    # for every classifier, concatenate the ids of each polygon over all chunks
+    memberships = [[np.concatenate(polygonIds) for polygonIds in zip(*chunks)] for chunks in chunkIds]
+    return pc_array, colors, memberships
@@ -0,0 +1,76 @@
+import math
+import zlib
+import struct
+import numpy as np
+import vtk
+import vtk.util.numpy_support as vtk_np
+'''
+High resolution posters of a view, far larger than the screen, e.g. 16384 x 16384 pixels.
+
+renderPoster renders the view as a grid of tiles, each the size of the window, by magnifying the camera and
+moving its window center from tile to tile. Each row of tiles is written to the PNG file as soon as it is rendered,
+through a streaming PNG writer, so memory stays bounded by one row of tiles whatever the size of the poster.
+'''
+class StreamingPNGWriter(object):
+    # writes an 8 bit RGB PNG file of width x height pixels, given its rows top to bottom in any number of calls
+    def __init__(self, path, width, height, level=6):
+        super(StreamingPNGWriter, self).__init__()
+
+        self.width = width
+        self.fp = open(path, 'wb')
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        self.writeChunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+        self.compressor = zlib.compressobj(level)
+
+    def writeChunk(self, kind, data):
+        self.fp.write(struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    # rows is a (n, width, 3) uint8 array; every row is stored unfiltered, after a zero filter byte
+    def writeRows(self, rows):
+        data = np.zeros((len(rows), self.width * 3 + 1), dtype=np.uint8)
+        data[:,1:] = rows.reshape(len(rows), -1)
+        compressed = self.compressor.compress(data.tobytes())
+        if compressed:
+            self.writeChunk(b'IDAT', compressed)
+
+    def close(self):
+        self.writeChunk(b'IDAT', self.compressor.flush())
+        self.writeChunk(b'IEND', b'')
+        self.fp.close()
+
+# renders renderer, drawn over the whole render window, magnification times larger than the window in each
+# direction, and writes it to the PNG file at path; returns the size of the poster. The camera is restored after
+def renderPoster(renderWindow, renderer, path, magnification):
+    width, height = renderWindow.GetSize()
+    camera = renderer.GetActiveCamera()
+    viewAngle = camera.GetViewAngle()
+    parallelScale = camera.GetParallelScale()
+    windowCenter = camera.GetWindowCenter()
+
+    # the view seen through the whole window now spans magnification windows
+    camera.SetViewAngle(math.degrees(2 * math.atan(math.tan(math.radians(viewAngle / 2)) / magnification)))
+    camera.SetParallelScale(parallelScale / magnification)
+
+    grab = vtk.vtkWindowToImageFilter()
+    grab.SetInput(renderWindow)
+    grab.ReadFrontBufferOff()
+
+    writer = StreamingPNGWriter(path, width * magnification, height * magnification)
+    try:
+        strip = np.empty((height, width * magnification, 3), dtype=np.uint8)
+        for ty in reversed(range(magnification)): # PNG rows go top to bottom
+            for tx in range(magnification):
+                camera.SetWindowCenter(windowCenter[0] * magnification + 2 * tx - (magnification - 1),
+                                       windowCenter[1] * magnification + 2 * ty - (magnification - 1))
+                grab.Modified()
+                grab.Update()
+                tile = vtk_np.vtk_to_numpy(grab.GetOutput().GetPointData().GetScalars()).reshape(height, width, -1)
+                strip[:, tx*width:(tx+1)*width] = tile[::-1,:,0:3] # VTK images go bottom to top
+            writer.writeRows(strip)
+    finally:
+        writer.close()
+        camera.SetViewAngle(viewAngle)
+        camera.SetParallelScale(parallelScale)
+        camera.SetWindowCenter(*windowCenter)
+        renderWindow.Render()
+    return width * magnification, height * magnification
@@ -0,0 +1,133 @@
+import os
+import sys
+import pickle
+import argparse
+import geopandas as gpd
+import concurrent.futures
+from classification import pointClassifier, classificationEngine, geometryHashes, saveMembershipCache
+from pointcloud import loadPointCloud, cloudSignature
+from spatial_index import GridIndex
+'''
+Headless preprocessing: finds the points within every wall/structure polygon, without starting the GUI,
+and writes the preprocessed points pickle files (and optionally the membership cache) that final.py reads.
+Finished batches of polygons are checkpointed, so an interrupted run resumes where it stopped.
+'''
+# point cloud and grid index shared by the worker processes
+_pc_array = None
+_grid = None
+
+def _initWorker(pc_array, grid):
+    global _pc_array, _grid
+    _pc_array = pc_array
+    _grid = grid
+
+# classifies one batch of polygons against the whole point cloud
+def classifyBatch(task):
+    name, batch, geometries, engine = task
+    boundaries, raster, refine = engine
+    return name, batch, pointClassifier(geometries, boundaries, raster, refine, grid=_grid)(_pc_array)
+
+# prints a progress bar on one line
+def progress(done, total, label):
+    width = 40
+    filled = int(width * done / max(total, 1))
+    sys.stderr.write('\r' + label + ' [' + '#' * filled + '-' * (width - filled) + '] ' + str(done) + '/' + str(total))
+    if done == total:
+        sys.stderr.write('\n')
+    sys.stderr.flush()
+
+def checkpointPath(name, batch):
+    return os.path.join(args.checkpoint, name + '_' + str(batch).zfill(5) + '.pkl')
+
+# returns the ids stored for a batch, if its checkpoint was made from the same point cloud and polygons
+def loadCheckpoint(name, batch, signature, hashes):
+    path = checkpointPath(name, batch)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fp:
+        checkpoint = pickle.load(fp)
+    if checkpoint['signature'] != signature or checkpoint['hashes'] != hashes:
+        return None
+    return checkpoint['ids']
+
+# written to a temporary file first, so a crash never leaves a truncated checkpoint behind
+def saveCheckpoint(name, batch, signature, hashes, ids):
+    path = checkpointPath(name, batch)
+    with open(path + '.tmp', 'wb') as fp:
+        pickle.dump({'signature': signature, 'hashes': hashes, 'ids': ids}, fp, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+if __name__ == '__main__':
+    global args
+
+    parser = argparse.ArgumentParser(description='CS53000 Final Project preprocessing')
+    parser.add_argument('-i', '--input', required=True, type=str, help='Path of the point cloud dataset; a LAS file, a directory of LAS tiles or a glob of LAS tiles')
+    parser.add_argument('-w', '--walls', required=True, type=str, help='Path of the Walls Shapefile')
+    parser.add_argument('-s', '--structures', required=True, type=str, help='Path of the Structures Shapefile')
+    parser.add_argument('--wallsfile', required=True, type=str, help='Path of the preprocessed points pkl file to write for walls')
+    parser.add_argument('--structuresfile', required=True, type=str, help='Path of the preprocessed points pkl file to write for structures')
+    parser.add_argument('-a', '--all', action='store_true', help='Use all points instead of reducing')
+    parser.add_argument('--step', required=False, type=int, help='Keep every step-th point instead of every 100th, as with final.py --step')
+    parser.add_argument('-b', '--boundaries', action='store_true', help='Calculate and use actual wall boundaries instead of bounding boxes')
+    parser.add_argument('-r', '--raster', required=False, type=float, help='Classify points with a label raster of the polygons, with cells of this size in meters')
+    parser.add_argument('--refine', action='store_true', help='With --raster, test the points in boundary cells against the actual polygons, matching -b')
+    parser.add_argument('--incremental', required=False, type=str, help='Path of the membership cache to write for final.py --incremental')
+    parser.add_argument('--checkpoint', required=False, type=str, default='checkpoints', help='Directory of the checkpoints of finished polygon batches')
+    parser.add_argument('--batch', required=False, type=int, default=50, help='Number of polygons per batch')
+    parser.add_argument('--workers', required=False, type=int, help='Number of worker processes')
+
+    args = parser.parse_args()
+    if args.step and args.all:
+        parser.error('-a keeps every point; use either -a or --step')
+    if args.incremental and args.raster and not args.refine: # the cache must not depend on how polygons are batched
+        parser.error('--incremental with --raster needs --refine: without it, a cell covered by overlapping polygons goes to the last one rasterized, which depends on the polygons classified together')
+    os.makedirs(args.checkpoint, exist_ok=True)
+
+    shapefiles = {'walls': gpd.read_file(args.walls), 'structures': gpd.read_file(args.structures)}
+    step = args.step or (1 if args.all else 100) # same reduction as final.py
+    signature = cloudSignature(args.input, step)
+    engine = classificationEngine(args.boundaries, args.raster, args.refine)
+
+    print('Reading ' + args.input)
+    pc_array, colors, _ = loadPointCloud(args.input, step)
+    del colors
+    grid = GridIndex(pc_array[:,0:2])
+
+    # split every shapefile into batches, keeping the ones already checkpointed
+    hashes = {name: geometryHashes(shapefile['geometry'], engine) for name, shapefile in shapefiles.items()}
+    ids = {name: [None] * len(shapefile) for name, shapefile in shapefiles.items()}
+    tasks = []
+    for name, shapefile in shapefiles.items():
+        for batch, start in enumerate(range(0, len(shapefile), args.batch)):
+            stop = min(start + args.batch, len(shapefile))
+            done = loadCheckpoint(name, batch, signature, hashes[name][start:stop])
+            if done is not None:
+                ids[name][start:stop] = done
+            else:
+                tasks.append((name, batch, list(shapefile['geometry'].iloc[start:stop]), (args.boundaries, args.raster, args.refine)))
+
+    total = sum(len(range(0, len(shapefile), args.batch)) for shapefile in shapefiles.values())
+    finished = total - len(tasks)
+    print('Resuming: ' + str(finished) + ' of ' + str(total) + ' batches already checkpointed')
+    progress(finished, total, 'Classifying')
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=_initWorker, initargs=(pc_array, grid)) as executor:
+        futures = [executor.submit(classifyBatch, task) for task in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            name, batch, batchIds = future.result()
+            start = batch * args.batch
+            saveCheckpoint(name, batch, signature, hashes[name][start:start+len(batchIds)], batchIds)
+            ids[name][start:start+len(batchIds)] = batchIds
+            finished += 1
+            progress(finished, total, 'Classifying')
+
+    # same format as the pickle files read by final.py: the points within each polygon
+    for name, path in [('walls', args.wallsfile), ('structures', args.structuresfile)]:
+        with open(path, 'wb') as fp:
+            pickle.dump([pc_array[idx] for idx in ids[name]], fp)
+        print(path + ' has been successfully exported')
+
+    if args.incremental:
+        saveMembershipCache(args.incremental, signature, {h: idx for name in ids for h, idx in zip(hashes[name], ids[name])})
+        print(args.incremental + ' has been successfully exported')
@@ -0,0 +1,349 @@
+import pickle
+import numpy as np
+import pandas as pd
+from spatial_index import GridIndex, mortonOrder
+from classification import pointClassifier, classificationEngine, geometryHashes, loadMembershipCache, saveMembershipCache
+from pointcloud import loadPointCloud, cloudSignature, lasPaths, CHUNK_SIZE
+from ground import GroundModel
+from change_detection import nearestDistances
+from overview import OverviewRaster
+from budget import chooseReduction
+from attribute_store import readShapefile
+'''
+The site model: the point cloud, the walls and structures polygons, the points within each polygon and the
+attribute layers, independent of the GUI, so it can be used from notebooks or batch jobs.
+
+    model = SiteModel('cloud.las', 'walls.shp', 'structures.shp', boundaries=True)
+    model.pointsWhere('walls', 'clase_rev', 'Muro de plataforma')
+'''
+# returns dictionary of (category string: list of points) key-value pairs, creating a apir for each category in shapefile['header']
+def categorical_arrays(shapefile, header):
+    return shapefile.groupby(header)['pts'].agg(lambda x: np.concatenate(x.values, axis=0)).to_dict()
+
+class SiteModel(object):
+    # creates dictionaries for numerical and categorical datatypes with (category name string: [column name in walls shapefile string, column name in structures shapefile string]) key value pairs
+    numericalDict = {'Wall Thickness': ['grosor', 'grosor_1'], 'Maximum Original Height': ['alt_max', None], 'Maximum Conserved Height': ['alt_cons', 'alt'], 'Height Above Ground': [None, None]}
+    categoryDict = {'None': 'None', 'Type of Wall/Structure': ['clase_rev', 'design_co1'] , 'Completeness': ['preserva_1', 'preserva_1'], 'Time of Construction': [None, 'temp_con_2']}
+    attributes = ['None', 'Type of Wall/Structure', 'Completeness', 'Wall Thickness', 'Maximum Original Height', 'Maximum Conserved Height', 'Time of Construction', 'Height Above Ground']
+
+    # reads the point cloud at input and the walls and structures shapefiles, and finds the points within every
+    # polygon; the options are those of final.py, see the README
+    def __init__(self, input, walls, structures, wallsfile=None, structuresfile=None, allPoints=False, boundaries=False,
+                 raster=None, refine=False, groundcell=2.0, noground=None, insidestep=None, morton=False, incremental=None, epoch=None,
+                 maxMemory=None, maxGpuPoints=None, shapeCache=None, step=None):
+        super(SiteModel, self).__init__()
+
+        self.attributes = list(self.attributes)
+        if incremental and raster and not refine:
+            raise ValueError('incremental with raster needs refine, so the points of a polygon do not depend on the polygons classified with it')
+
+        # read in the shapefiles, from the attribute store while they are unchanged
+        self.shapefileWalls, wallsBounds = readShapefile(walls, shapeCache)
+        self.shapefileStructures, structuresBounds = readShapefile(structures, shapeCache)
+        self.shapefiles = {'walls': self.shapefileWalls, 'structures': self.shapefileStructures}
+        self.polygonBounds = {'walls': wallsBounds, 'structures': structuresBounds} # xmin, ymin, xmax, ymax of every polygon
+
+        # shapefiles without a preprocessed points file are classified while the point cloud is read, one chunk
+        # of points at a time; in incremental mode, only the polygons missing from the membership cache are
+        # classified. With an insidestep, the points kept depend on every polygon, so cached point ids can not be reused
+        step = step or (1 if allPoints else 100) # Randomly reducing the points by a factor of 100 by default
+        pointLayers = True # layers covering the whole cloud, such as the height above ground
+        workers, chunkSize = None, CHUNK_SIZE # processes reading the point cloud, and points decoded by each at once
+
+        # with a budget, the reduction and layers are picked from the LAS headers before any point is read
+        if maxMemory is not None or maxGpuPoints is not None:
+            pklfiles = {'walls': wallsfile, 'structures': structuresfile}
+            area = sum(self.shapefiles[name].area.sum() for name, pklfile in pklfiles.items() if not pklfile)
+            step, pointLayers, (workers, chunkSize), nBytes, gpuPoints, fits = chooseReduction(
+                lasPaths(input), area, maxMemory, maxGpuPoints, insidestep, 1 + (epoch is not None),
+                [pklfile for pklfile in pklfiles.values() if pklfile], lasPaths(epoch) if epoch is not None else ())
+            print('Memory budget: keeping 1 in ' + str(step) + ' points, about ' + str(int(nBytes / 2**20)) + ' MB and ' + str(int(gpuPoints)) + ' points drawn; '
+                  + ('with' if pointLayers else 'without') + ' the layers covering the whole cloud, read by ' + str(workers) + ' processes '
+                  + str(chunkSize) + ' points at a time')
+            if not fits:
+                print('Warning: the budget can not be met, even keeping 1 in ' + str(step) + ' points; expect about ' + str(int(nBytes / 2**20))
+                      + ' MB and ' + str(int(gpuPoints)) + ' points drawn')
+        signature = cloudSignature(input, step, insidestep)
+        cache = loadMembershipCache(incremental, signature) if incremental and insidestep is None else dict()
+        hashes = dict()
+        todo = dict()
+        classifiers = []
+        for name, pklfile in [('walls', wallsfile), ('structures', structuresfile)]:
+            if pklfile:
+                continue
+            shapefile = self.shapefiles[name]
+            hashes[name] = geometryHashes(shapefile['geometry'], classificationEngine(boundaries, raster, refine))
+            todo[name] = [i for i, h in enumerate(hashes[name]) if h not in cache]
+            if incremental:
+                print('Classifying ' + str(len(todo[name])) + ' of ' + str(len(hashes[name])) + ' ' + name + ' polygons, reusing the rest')
+            if todo[name]:
+                classifiers.append(pointClassifier(shapefile['geometry'].iloc[todo[name]], boundaries, raster, refine))
+
+        # read in pointcloud data and colors for each point, decoding the file or tiles in parallel
+        # with an insidestep, the points within the polygons are reduced by that factor only
+        # the top-down overview map is filled with every point decoded on the way
+        self.overview = OverviewRaster(lasPaths(input))
+        self.pc_array, self.colors, memberships = loadPointCloud(input, step, classifiers, insidestep, self.overview, workers, chunkSize)
+        if insidestep is not None:
+            print(str(self.pc_array.shape[0]) + ' points kept, every ' + str(insidestep) + ' within the polygons and every ' + str(step) + ' elsewhere')
+
+        # ids of the points within each polygon, either just found or reused from the cache
+        ids = dict()
+        for name in hashes:
+            found = dict(zip(todo[name], memberships.pop(0))) if todo[name] else dict()
+            ids[name] = [found[i] if i in found else cache[h] for i, h in enumerate(hashes[name])]
+        if incremental:
+            saveMembershipCache(incremental, signature, {h: idx for name in ids for h, idx in zip(hashes[name], ids[name])})
+
+        # height of every point above the estimated terrain, so walls on the hillside can be compared
+        self.groundModel = GroundModel(self.pc_array, groundcell)
+        self.heightAboveGround = self.groundModel.heightAboveGround(self.pc_array)
+
+        # drop the ground points, renumbering the point ids within each polygon
+        if noground is not None:
+            keep = self.heightAboveGround >= noground
+            newIds = np.cumsum(keep) - 1
+            for name in ids:
+                ids[name] = [newIds[idx[keep[idx]]] for idx in ids[name]]
+            self.pc_array = self.pc_array[keep]
+            self.colors = self.colors[keep]
+            self.heightAboveGround = self.heightAboveGround[keep]
+
+        # reorder the points along a Z-order curve, keeping the permutation from the original point order; the
+        # ids within each polygon are sorted too, so gathering the points of a polygon walks memory forward
+        self.mortonOrder = None
+        if morton:
+            self.mortonOrder = mortonOrder(self.pc_array[:,0:2])
+            rank = np.empty_like(self.mortonOrder)
+            rank[self.mortonOrder] = np.arange(len(self.mortonOrder))
+            for name in ids:
+                ids[name] = [np.sort(rank[idx]) for idx in ids[name]]
+            self.pc_array = self.pc_array[self.mortonOrder]
+            self.colors = self.colors[self.mortonOrder]
+            self.heightAboveGround = self.heightAboveGround[self.mortonOrder]
+
+        self.nCoords = self.pc_array.shape[0]
+        self.nElem = self.pc_array.shape[1]
+
+        # 2D grid index over the points, used to resolve the clip region and box queries without masking every point
+        self.grid = GridIndex(self.pc_array[:,0:2])
+
+        # presort points into each wall component, so we do not have to do it everytime we change category
+        # ids of the points within each polygon, None for a shapefile read from a preprocessed points file
+        self.polygonIds = dict()
+        pts = dict()
+        for name, pklfile in [('walls', wallsfile), ('structures', structuresfile)]:
+            if pklfile: # read in preprocessed points
+                with open(pklfile, 'rb') as fp:
+                    pts[name] = pickle.load(fp)
+                if noground is not None:
+                    pts[name] = [pt[self.groundModel.heightAboveGround(pt) >= noground] for pt in pts[name]]
+                self.polygonIds[name] = None
+            else: # points found while reading the point cloud
+                pts[name] = [self.pc_array[idx] for idx in ids[name]]
+                self.polygonIds[name] = ids[name]
+
+        # the points of all polygons are stored in one array, polygon after polygon, walls first; each shapefile's
+        # points and the pts column are views into it, so the points of any polygon are a contiguous range, and
+        # the numerical layers of the polygons all share it
+        self.polygonPoints = dict()
+        self.polygonOffsets = dict()
+        for name, shapefile in self.shapefiles.items():
+            # remove entries that have no points in them
+            mask = sorted((i for i, pt in enumerate(pts[name]) if len(pt) == 0), reverse=True)
+            for i in mask:
+                del pts[name][i]
+                shapefile.drop(i, inplace=True)
+                if self.polygonIds[name] is not None:
+                    del self.polygonIds[name][i]
+            self.polygonBounds[name] = np.delete(self.polygonBounds[name], mask, axis=0)
+
+            self.polygonOffsets[name] = np.concatenate([[0], np.cumsum([len(pt) for pt in pts[name]])]).astype(np.int64)
+        self.allPolygonPoints = np.concatenate([pt for name in self.shapefiles for pt in pts[name]] + [np.empty((0, 3))], axis=0)
+        del pts
+        start = 0
+        for name, shapefile in self.shapefiles.items():
+            self.polygonPoints[name] = self.allPolygonPoints[start:start+self.polygonOffsets[name][-1]]
+            start += self.polygonOffsets[name][-1]
+            # add pts columns to walls shapefile and structures shapefile
+            shapefile['pts'] = self.pointsOfPolygons(name, range(len(shapefile)))
+
+        # building the max height structure column
+        self.shapefileStructures['alt_muro'] = pd.to_numeric(self.shapefileStructures['alt_muro_1'], 'coerce')
+        self.shapefileStructures['alt'] = self.shapefileStructures[['alt_muro', 'altura_has', 'altura_h_1']].max(axis=1)
+
+        # change thickness from strings to numbers, and removing outliers / entry errors in column
+        self.shapefileStructures['grosor_1'] = pd.to_numeric(self.shapefileStructures['grosor_1'], 'coerce')
+        self.shapefileStructures.at[self.shapefileStructures[self.shapefileStructures['grosor_1'] == self.shapefileStructures['grosor_1'].max()]['grosor_1'].index[0], 'grosor_1'] /= 10 # fixing incorrectly labeled thickness
+        self.shapefileStructures.at[self.shapefileStructures[self.shapefileStructures['grosor_1'] == self.shapefileStructures['grosor_1'].max()]['grosor_1'].index[0], 'grosor_1'] /= 10 # fixing incorrectly labeled thickness
+        self.shapefileStructures.at[self.shapefileStructures[self.shapefileStructures['grosor_1'] == self.shapefileStructures['grosor_1'].max()]['grosor_1'].index[0], 'grosor_1'] /= 10 # fixing incorrectly labeled thickness
+
+        # numerical attributes with one value per point rather than per polygon
+        self.pointValues = {'Height Above Ground': self.heightAboveGround}
+        if not pointLayers:
+            self.attributes.remove('Height Above Ground')
+
+        # distance from every point to the nearest point of another survey epoch, read with the same reduction
+        if epoch is not None and pointLayers:
+            print('Comparing with ' + epoch)
+            other, _, _ = loadPointCloud(epoch, step, workers=workers, chunkSize=chunkSize)
+            self.pointValues['Distance to Other Epoch'] = nearestDistances(self.pc_array, other)
+            del other
+            self.attributes.append('Distance to Other Epoch')
+
+        self.labels = dict() # polygon of every point, per shapefile, computed on first use
+        self.buildLayers()
+
+    # builds the points and per point colors or values of every layer, used by the GUI and the exporters;
+    # the points of a categorical layer are grouped by category, with 'offsets' giving the range of each category.
+    # A numerical layer shares its points with other layers (the whole cloud or all polygon points), and 'order'
+    # lists them sorted by value, so any range of values is a contiguous range of 'order'
+    def buildLayers(self):
+        self.layers = {'None': {'points': self.pc_array, 'colors': self.colors}}
+
+        for attribute in self.attributes:
+            if attribute == 'None':
+                continue
+            elif attribute in self.categoryDict:
+                self.layers[attribute] = self.categoricalLayer(attribute)
+            elif attribute in self.pointValues:
+                self.layers[attribute] = self.pointLayer(attribute)
+            else:
+                self.layers[attribute] = self.numericalLayer(attribute)
+
+    # returns the layer of a categorical attribute
+    def categoricalLayer(self, attribute):
+        if attribute == 'Type of Wall/Structure':
+            masterListWalls = categorical_arrays(self.shapefileWalls, self.categoryDict[attribute][0])
+            masterListStructures = categorical_arrays(self.shapefileStructures, self.categoryDict[attribute][1])
+            masterList = masterListWalls | masterListStructures # merge the two together
+        elif attribute == 'Completeness':
+            masterListWalls = categorical_arrays(self.shapefileWalls, self.categoryDict[attribute][0])
+            masterListStructures = categorical_arrays(self.shapefileStructures, self.categoryDict[attribute][1])
+            masterList = dict()
+            for c in masterListStructures.keys():
+                masterList[c] = np.concatenate([masterListWalls[c], masterListStructures[c]], axis=0)
+        elif attribute == 'Time of Construction':
+            masterList = categorical_arrays(self.shapefileStructures, self.categoryDict[attribute][1])
+
+        sizes = [len(arr) for arr in masterList.values()]
+        return {'points': np.concatenate(list(masterList.values()), axis=0),
+                'values': np.repeat(np.arange(len(masterList)), sizes),
+                'categories': list(masterList.keys()),
+                'offsets': np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)}
+
+    # returns the layer of a numerical attribute, with the range of its color scale
+    def numericalLayer(self, attribute):
+        if attribute == 'Wall Thickness' or attribute == 'Maximum Conserved Height':
+            minValWalls, maxValWalls = self.shapefileWalls[self.numericalDict[attribute][0]].agg(['min', 'max'])
+            minValStructures, maxValStructures = self.shapefileStructures[self.numericalDict[attribute][1]].agg(['min', 'max'])
+            minVal = min(minValWalls, minValStructures)
+            maxVal = max(maxValWalls, maxValStructures)
+
+            # every point takes the value of the polygon it is in
+            points = self.allPolygonPoints
+            values = np.concatenate([np.repeat(self.shapefileWalls[self.numericalDict[attribute][0]].values, np.diff(self.polygonOffsets['walls'])),
+                                     np.repeat(self.shapefileStructures[self.numericalDict[attribute][1]].values, np.diff(self.polygonOffsets['structures']))])
+
+        elif attribute == 'Maximum Original Height':
+            minVal, maxVal = self.shapefileWalls[self.numericalDict[attribute][0]].agg(['min', 'max'])
+
+            points = self.polygonPoints['walls']
+            values = np.repeat(self.shapefileWalls[self.numericalDict[attribute][0]].values, np.diff(self.polygonOffsets['walls']))
+
+        values = np.asarray(values, dtype=np.float64)
+        return {'points': points, 'values': values, 'order': np.argsort(values, kind='stable'), 'range': (minVal, maxVal)}
+
+    # returns the layer of a numerical attribute with one value per point
+    def pointLayer(self, attribute):
+        values = self.pointValues[attribute]
+        # a few points far from the others would squeeze the color scale
+        minVal, maxVal = np.percentile(values, [0.5, 99.5])
+        return {'points': self.pc_array, 'values': values, 'order': np.argsort(values, kind='stable'), 'range': (minVal, maxVal)}
+
+    # returns the ids of the points inside bounds (xmin, xmax, ymin, ymax)
+    def idsInBox(self, bounds):
+        return self.grid.query(bounds)
+
+    # returns the points inside bounds (xmin, xmax, ymin, ymax)
+    def pointsInBox(self, bounds):
+        return self.pc_array[self.grid.query(bounds)]
+
+    # returns the ids of the points within halfWidth of the vertical plane through p0 and p1, between them, and
+    # their distance along the line from p0
+    def idsInSlab(self, p0, p1, halfWidth):
+        return self.grid.querySlab(p0, p1, halfWidth)
+
+    # returns the value of attribute for every polygon of a shapefile ('walls' or 'structures'): the value of its
+    # column for numerical attributes, the position of its category in the layer for categorical ones, and NaN
+    # where the polygon has none, e.g. for attributes with one value per point
+    def polygonValues(self, name, attribute):
+        shapefile = self.shapefiles[name]
+        k = list(self.shapefiles).index(name)
+        if attribute != 'None' and attribute in self.categoryDict and self.categoryDict[attribute][k] is not None:
+            categories = {c: i for i, c in enumerate(self.layers[attribute]['categories'])}
+            return np.array([categories.get(c, np.nan) for c in shapefile[self.categoryDict[attribute][k]]], dtype=np.float64)
+        if attribute in self.numericalDict and self.numericalDict[attribute][k] is not None:
+            return pd.to_numeric(shapefile[self.numericalDict[attribute][k]], 'coerce').to_numpy(dtype=np.float64)
+        return np.full(len(shapefile), np.nan)
+
+    # returns the positions of the polygons of a shapefile ('walls' or 'structures') whose bounds intersect
+    # bounds (xmin, xmax, ymin, ymax)
+    def polygonsInBox(self, name, bounds):
+        b = self.polygonBounds[name]
+        return np.flatnonzero((b[:,0] <= bounds[1]) & (b[:,2] >= bounds[0]) & (b[:,1] <= bounds[3]) & (b[:,3] >= bounds[2]))
+
+    # returns the positions of the polygons of a shapefile ('walls' or 'structures') whose column equals value;
+    # a string value is converted for numerical columns
+    def polygonsWhere(self, name, column, value):
+        if isinstance(value, str) and pd.api.types.is_numeric_dtype(self.shapefiles[name][column]):
+            value = float(value)
+        return np.flatnonzero((self.shapefiles[name][column] == value).values)
+
+    # returns the points of the given polygons of a shapefile, as views into the points of all its polygons
+    def pointsOfPolygons(self, name, polygons):
+        points = self.polygonPoints[name]
+        offsets = self.polygonOffsets[name]
+        return [points[offsets[i]:offsets[i+1]] for i in polygons]
+
+    # returns the points of the polygons whose column equals value, e.g. pointsWhere('walls', 'clase_rev', X),
+    # one view per polygon
+    def pointsWhere(self, name, column, value):
+        return self.pointsOfPolygons(name, self.polygonsWhere(name, column, value))
+
+    # returns the ids of the points of the polygons whose column equals value
+    def idsWhere(self, name, column, value):
+        ids = self.polygonIdsOf(name)
+        return np.concatenate([ids[i] for i in self.polygonsWhere(name, column, value)] + [np.empty(0, dtype=np.int64)])
+
+    def polygonIdsOf(self, name):
+        if self.polygonIds[name] is None:
+            raise ValueError('The ' + name + ' points were read from a preprocessed points file, so their point ids are not known')
+        return self.polygonIds[name]
+
+    # returns the position of the polygon of a shapefile that every point is in, or -1
+    def pointLabels(self, name):
+        if name not in self.labels:
+            labels = np.full(self.nCoords, -1, dtype=np.int32)
+            for i, idx in enumerate(self.polygonIdsOf(name)):
+                labels[idx] = i
+            self.labels[name] = labels
+        return self.labels[name]
+
+    # returns the value of an attribute for the points with the given ids: the value of the polygon they are in,
+    # structures taking precedence over walls as in the layers, or NaN / None outside the polygons; the natural
+    # colors for 'None', as 8 bit RGBA
+    def attributeValues(self, attribute, ids):
+        if attribute == 'None':
+            return self.colors[ids]
+        if attribute in self.pointValues:
+            return self.pointValues[attribute][ids]
+        columns = self.numericalDict.get(attribute) or self.categoryDict[attribute]
+        values = np.full(len(ids), np.nan) if attribute in self.numericalDict else np.full(len(ids), None, dtype=object)
+        for name, column in zip(['walls', 'structures'], columns):
+            if column is None:
+                continue
+            labels = self.pointLabels(name)[ids]
+            inside = labels >= 0
+            values[inside] = self.shapefiles[name][column].values[labels[inside]]
+        return values
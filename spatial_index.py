@@ -0,0 +1,138 @@
+import numpy as np
+'''
+Spatial indexing helpers for the point cloud
+'''
+class Grid(object):
+    # regular 2D grid of square cells of cellSize over the xy plane, starting at origin; shape is (rows, columns),
+    # rows along y, or the grid is sized to cover the points up to maxs
+    def __init__(self, origin, cellSize, shape=None, maxs=None):
+        super(Grid, self).__init__()
+
+        self.origin = np.asarray(origin, dtype=np.float64)
+        self.cellSize = cellSize
+        if shape is None:
+            extent = np.asarray(maxs, dtype=np.float64) - self.origin
+            shape = (int(extent[1] // cellSize) + 1, int(extent[0] // cellSize) + 1)
+        self.shape = shape
+
+    # returns the (column, row) of the cell each point falls in, clamped to the grid; without clamp, points off
+    # the grid get out of range values
+    def cellCoords(self, xy, clamp=True):
+        ix = ((xy[:,0] - self.origin[0]) // self.cellSize).astype(np.int64)
+        iy = ((xy[:,1] - self.origin[1]) // self.cellSize).astype(np.int64)
+        if clamp:
+            ix = np.clip(ix, 0, self.shape[1] - 1)
+            iy = np.clip(iy, 0, self.shape[0] - 1)
+        return ix, iy
+
+    # returns the flat id of the cell each point falls in, clamped to the grid
+    def cellOf(self, xy):
+        ix, iy = self.cellCoords(xy)
+        return iy * self.shape[1] + ix
+
+class GridIndex(Grid):
+    # buckets points into the cells of a regular 2D grid over the xy plane; the point ids
+    # are stored sorted by cell, so every row of cells is one contiguous range of ids
+    def __init__(self, xy, cellSize=None, origin=None, shape=None, pointsPerCell=64):
+        nPoints = xy.shape[0]
+
+        if origin is None:
+            mins = xy.min(axis=0) if nPoints else np.zeros(2)
+            maxs = xy.max(axis=0) if nPoints else np.ones(2)
+            extent = np.maximum(maxs - mins, 1e-9)
+            if cellSize is None: # aim for a fixed average number of points per cell
+                cellSize = float(np.sqrt(extent[0] * extent[1] * pointsPerCell / max(nPoints, 1)))
+            origin = mins
+            shape = (int(extent[1] // cellSize) + 1, int(extent[0] // cellSize) + 1)
+        super(GridIndex, self).__init__(origin, cellSize, shape)
+
+        self.xy = xy
+        cellIds = self.cellOf(xy)
+        self.order = np.argsort(cellIds, kind='stable')
+        counts = np.bincount(cellIds, minlength=shape[0] * shape[1])
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # returns a new index over other points that shares this grid's cells
+    def subIndex(self, xy):
+        return GridIndex(xy, self.cellSize, self.origin, self.shape)
+
+    # returns the ids of the points inside bounds (xmin, xmax, ymin, ymax)
+    # only the points in the touched cells are looked at, one contiguous slice per row of cells
+    def query(self, bounds):
+        xmin, xmax, ymin, ymax = bounds[:4]
+        (ix0, ix1), (iy0, iy1) = self.cellCoords(np.array([[xmin, ymin], [xmax, ymax]]))
+        rowStarts = np.arange(iy0, iy1 + 1) * self.shape[1]
+        ranges = [self.order[self.offsets[r + ix0]:self.offsets[r + ix1 + 1]] for r in rowStarts]
+        candidates = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+
+        # exact test, needed only for the points in the cells on the border of the box
+        xy = self.xy[candidates]
+        mask = (xy[:,0] >= xmin) & (xy[:,0] <= xmax) & (xy[:,1] >= ymin) & (xy[:,1] <= ymax)
+        return candidates[mask]
+
+    # returns the ids of the points within halfWidth of the vertical plane through p0 and p1 (xy), between p0 and
+    # p1, and their distance along the line from p0; only the cells the slab crosses are looked at, one
+    # contiguous slice per row of cells, so thin diagonal slabs do not scan their whole bounding box
+    def querySlab(self, p0, p1, halfWidth):
+        p0 = np.asarray(p0, dtype=np.float64)[0:2]
+        p1 = np.asarray(p1, dtype=np.float64)[0:2]
+        length = max(np.linalg.norm(p1 - p0), 1e-9)
+        direction = (p1 - p0) / length
+        normal = np.array([-direction[1], direction[0]]) * halfWidth
+        corners = np.array([p0 + normal, p1 + normal, p1 - normal, p0 - normal])
+
+        # x extent of the slab within each row of cells: its corners in the row and its edges crossing the row borders
+        _, (iy0, iy1) = self.cellCoords(np.array([corners.min(axis=0), corners.max(axis=0)]))
+        ranges = []
+        for row in range(iy0, iy1 + 1):
+            ya = self.origin[1] + row * self.cellSize
+            yb = ya + self.cellSize
+            xs = [x for x, y in corners if ya <= y <= yb]
+            for (xa, ya0), (xb, yb0) in zip(corners, np.roll(corners, -1, axis=0)):
+                for yc in (ya, yb):
+                    if (ya0 - yc) * (yb0 - yc) <= 0 and ya0 != yb0:
+                        xs.append(xa + (xb - xa) * (yc - ya0) / (yb0 - ya0))
+            if not xs:
+                continue
+            (ix0, ix1), _ = self.cellCoords(np.array([[min(xs), ya], [max(xs), ya]]))
+            start = row * self.shape[1]
+            ranges.append(self.order[self.offsets[start + ix0]:self.offsets[start + ix1 + 1]])
+        candidates = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+
+        # exact test, in the coordinates along and across the line
+        relative = self.xy[candidates] - p0
+        along = relative @ direction
+        across = relative @ (normal / halfWidth)
+        mask = (along >= 0) & (along <= length) & (np.abs(across) <= halfWidth)
+        return candidates[mask], along[mask]
+
+# returns (column, row, ids) for every square tile of tileSize over xy that holds points, with tiles numbered from
+# offset, and the ids of each tile's points in their original order
+def tileGroups(xy, tileSize, offset=(0, 0)):
+    tx = ((xy[:,0] - offset[0]) // tileSize).astype(np.int64)
+    ty = ((xy[:,1] - offset[1]) // tileSize).astype(np.int64)
+    tileIds = tx * (ty.max() + 1) + ty if len(xy) else tx
+    order = np.argsort(tileIds, kind='stable')
+    bounds = np.flatnonzero(np.diff(tileIds[order])) + 1
+    return [(int(tx[ids[0]]), int(ty[ids[0]]), ids) for ids in np.split(order, bounds) if len(ids)]
+
+# spreads the lower 32 bits of every value to the even bits of a 64 bit value
+def _part1by1(v):
+    v = v.astype(np.uint64) & np.uint64(0x00000000FFFFFFFF)
+    for shift, mask in [(16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555)]:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+# returns the Z-order (Morton) code of every point on a 2^bits by 2^bits grid over the xy extent
+def mortonCodes(xy, bits=16):
+    mins = xy.min(axis=0)
+    extent = np.maximum(xy.max(axis=0) - mins, 1e-9)
+    q = np.minimum(((xy - mins) / extent * 2**bits).astype(np.int64), 2**bits - 1)
+    return _part1by1(q[:,0]) | (_part1by1(q[:,1]) << np.uint64(1))
+
+# returns the permutation that sorts the points along the Z-order curve; points close on the xy plane end up
+# close in memory, so the points of a cell, polygon or tile are read from a few contiguous ranges
+def mortonOrder(xy, bits=16):
+    if len(xy) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.argsort(mortonCodes(xy, bits), kind='stable')
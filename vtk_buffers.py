@@ -0,0 +1,74 @@
+import itertools
+import collections
+import numpy as np
+import vtk
+import vtk.util.numpy_support as vtk_np
+'''
+Hands the NumPy arrays of the point cloud and its layers to VTK without copying them.
+
+Every VTK array made by the BufferManager wraps the memory of a contiguous NumPy array, and the manager keeps
+that array alive until VTK deletes the VTK array. The vertex cells of every actor are views into one shared
+range of ids, allocated once, and actors drawing the same coordinates share one vtkPoints.
+'''
+class BufferManager(object):
+    # capacity is the largest number of points drawn by one actor, used to allocate the shared ids once
+    def __init__(self, capacity):
+        super(BufferManager, self).__init__()
+
+        self.ids = np.arange(capacity + 1, dtype=np.int64)
+        self.keys = itertools.count()
+        self.arrays = collections.OrderedDict() # key: (layer, array) of every live VTK array, in creation order
+        self.sharedPoints = dict() # (address, shape) of a coordinate buffer: the vtkPoints drawing it
+
+    # returns a VTK array using the memory of array; arrays VTK can not use as they are (not contiguous, or not
+    # of the id type for cells) are converted once here, so the copy shows up against the layer
+    def wrap(self, layer, array, idType=False):
+        array = np.ascontiguousarray(array, dtype=np.int64 if idType else None)
+        vtkArray = vtk_np.numpy_to_vtkIdTypeArray(array) if idType else vtk_np.numpy_to_vtk(array)
+        self.track(layer, array, vtkArray)
+        return vtkArray
+
+    # keeps array alive, and counted against layer, until VTK deletes vtkArray
+    def track(self, layer, array, vtkArray):
+        key = next(self.keys)
+        self.arrays[key] = (layer, array)
+        vtkArray.AddObserver('DeleteEvent', lambda caller, ev: self.arrays.pop(key, None))
+
+    # returns the vtkPoints of the coordinates in array, shared by every actor drawing the same buffer
+    def points(self, layer, array):
+        key = (array.__array_interface__['data'][0], array.shape)
+        if key not in self.sharedPoints:
+            verts = vtk.vtkPoints()
+            verts.SetData(self.wrap(layer, array))
+            self.sharedPoints[key] = verts
+        else: # shown as shared in the report
+            self.track(layer, array, self.sharedPoints[key].GetData())
+        return self.sharedPoints[key]
+
+    # returns vertex cells drawing the points with the given ids, or the first n points if ids is None; the
+    # offsets, and the ids of the first n points, are views into the shared ids
+    def cells(self, layer, n, ids=None):
+        if n + 1 > len(self.ids):
+            self.ids = np.arange(n + 1, dtype=np.int64)
+        cells = vtk.vtkCellArray()
+        offsets = self.wrap('Cell ids', self.ids[0:n+1], True)
+        connectivity = self.wrap('Cell ids', self.ids[0:n], True) if ids is None else self.wrap(layer, ids, True)
+        cells.SetData(offsets, connectivity)
+        return cells
+
+    # returns (layer: [bytes, bytes shared with layers listed before it]) of the arrays VTK currently holds;
+    # each underlying buffer is counted once, in full, against the first layer using it
+    def report(self):
+        seen = set()
+        sizes = collections.OrderedDict()
+        for layer, array in self.arrays.values():
+            root = array
+            while isinstance(root.base, np.ndarray):
+                root = root.base
+            size = sizes.setdefault(layer, [0, 0])
+            if id(root) in seen:
+                size[1] += array.nbytes
+            else:
+                seen.add(id(root))
+                size[0] += root.nbytes
+        return sizes